@@ -0,0 +1,99 @@
+# -*- coding:utf-8 -*-
+import argparse
+import csv
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_report  # noqa: E402
+from row_assembly import build_batch  # noqa: E402
+
+
+def load_csv(file):
+    rows = 0
+    for _ in csv.reader(file):
+        rows += 1
+    # without the header row
+    return rows - 1
+
+
+# how a downstream loader reads each --format back: csv rows parsed by the csv module, columnar files as
+# pyarrow tables; returns the rows read
+LOADERS = {
+    "csv": lambda path: load_csv(open(path)),
+    "csv.gz": lambda path: load_csv(gzip.open(path, "rt")),
+    "csv.zst": lambda path: load_csv(io.TextIOWrapper(
+        generate_report.zstandard.ZstdDecompressor().stream_reader(open(path, "rb")))),
+    "parquet": lambda path: generate_report.pyarrow.parquet.read_table(path).num_rows,
+    "arrow": lambda path: generate_report.pyarrow.ipc.open_file(path).read_all().num_rows,
+}
+
+
+def available(output_format):
+    if output_format in ("parquet", "arrow"):
+        return generate_report.pyarrow is not None
+    if output_format == "csv.zst":
+        return generate_report.zstandard is not None
+    return True
+
+
+def measure(output_format, layout, rows, work_dir):
+    # fields: [write seconds, bytes, load seconds]
+    path = os.path.join(work_dir, "report" + generate_report.REPORT_SINKS[output_format].extension)
+    started_at = time.perf_counter()
+    with generate_report.ReportFile(path, layout, None, generate_report.ROW_WINDOW,
+                                    generate_report.REPORT_SINKS[output_format]) as report:
+        for row in rows:
+            report.write(row)
+    written_at = time.perf_counter()
+    loaded = LOADERS[output_format](path)
+    loaded_at = time.perf_counter()
+    if loaded != len(rows):
+        raise RuntimeError(f"{output_format}: wrote {len(rows)} rows, loaded {loaded}")
+    size = os.path.getsize(path)
+    os.remove(path)
+    return written_at - started_at, size, loaded_at - written_at
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the report output formats (--format) on an in-memory batch: write time, file size "
+                    "and load time (no database).")
+    parser.add_argument("--rows", type=int, default=100000, help="rows in the report")
+    parser.add_argument("--assessments", type=int, default=5,
+                        help="pipeline assessments (as many non-pipeline ones are added)")
+    parser.add_argument("--scoring-dimensions", type=int, default=5)
+    parser.add_argument("--formats", nargs="+", choices=list(generate_report.REPORT_SINKS),
+                        default=list(generate_report.REPORT_SINKS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per format; the fastest write and load are kept")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    args = parser.parse_args()
+
+    layout, candidacies, lookups = build_batch(args.rows, args.assessments, args.scoring_dimensions, args.seed)
+    rows = [layout.plan.build_row(candidacy, "Job", *lookups) for candidacy in candidacies]
+
+    work_dir = tempfile.mkdtemp(prefix="report_formats_")
+    results = {}
+    try:
+        for output_format in args.formats:
+            if not available(output_format):
+                print(f"{output_format}: skipped, its package is not installed")
+                continue
+            runs = [measure(output_format, layout, rows, work_dir) for _ in range(args.repeat)]
+            results[output_format] = (min(run[0] for run in runs), runs[0][1], min(run[2] for run in runs))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{args.rows} rows of {len(layout.headers)} columns")
+    print(f"{'format':<10} {'write_s':>8} {'rows/s':>10} {'size_mb':>8} {'ratio':>6} {'load_s':>8}")
+    csv_size = results.get("csv", (None, None, None))[1]
+    for output_format, (write_s, size, load_s) in results.items():
+        ratio = f"{size / csv_size:.2f}" if csv_size else "-"
+        print(f"{output_format:<10} {write_s:>8.3f} {args.rows / write_s:>10,.0f} {size / 2 ** 20:>8.1f} "
+              f"{ratio:>6} {load_s:>8.3f}")
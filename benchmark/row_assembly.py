@@ -0,0 +1,90 @@
+# -*- coding:utf-8 -*-
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_report  # noqa: E402
+
+
+def build_batch(rows, assessments, scoring_dimensions, seed):
+    # a ReportLayout and one batch of candidacy tuples with the bulk lookups load_row_lookups would return;
+    # every candidacy has metrics; about two thirds of the user assessments, ratings and answers are present
+    rng = random.Random(seed)
+    assessment_rows = [(idx, f"Assessment {idx}", "test", f"assessment-{idx}", None, None)
+                       for idx in range(1, 2 * assessments + 1)]
+    scoring_dimension_rows = [(idx, f"Dimension {idx}", 1) for idx in range(1, scoring_dimensions + 1)]
+    layout = generate_report.ReportLayout(assessment_rows[:assessments],
+                                          scoring_dimension_rows,
+                                          assessment_rows[assessments:],
+                                          [],
+                                          [(1, 1, "Referral", "referral", "text")])
+
+    now = datetime.now()
+    candidacies = []
+    for candidacy_id in range(1, rows + 1):
+        candidacy = [None] * len(generate_report.CANDIDACY_FIELDS)
+        for idx, field in enumerate(generate_report.CANDIDACY_FIELDS):
+            candidacy[idx] = f"{field}-{candidacy_id}"
+        for field, value in [("e_candidacies.id", candidacy_id),
+                             ("e_candidacies.user_id", candidacy_id),
+                             ("e_users.id", candidacy_id),
+                             ("e_candidacies.percentile", rng.random() * 100),
+                             ("e_candidacies.weighted_percentage_score", rng.random() * 100),
+                             ("e_candidacies.remaining_assessment_count", rng.randrange(assessments + 1)),
+                             ("e_candidacies.failed", rng.random() < 0.1),
+                             ("e_candidacies.created_at", now - timedelta(days=rng.randrange(400)))]:
+            candidacy[generate_report.CANDIDACY_FIELDS.index(field)] = value
+        candidacies.append(tuple(candidacy))
+
+    candidate_ids = [candidacy_id for candidacy_id in range(1, rows + 1)]
+    metrics = generate_report.build_candidacy_metrics(
+        candidate_ids,
+        [(candidacy_id, "tag") for candidacy_id in candidate_ids],
+        [(candidacy_id, 2) for candidacy_id in candidate_ids],
+        [(candidacy_id, "email", now, 3) for candidacy_id in candidate_ids],
+        [(candidacy_id, now) for candidacy_id in candidate_ids],
+    )
+    assessment_ids = [assessment[0] for assessment in layout.all_assessments]
+    assessment_index = {assessment_id: idx for idx, assessment_id in enumerate(assessment_ids)}
+    user_assessment_rows = [(candidacy_id, assessment_id, 75.0, 9, now, now)
+                            for candidacy_id in candidate_ids for assessment_id in assessment_ids
+                            if rng.random() < 0.66]
+    user_assessments = (assessment_index,
+                        generate_report.build_user_assessment_matrix(assessment_index, user_assessment_rows))
+    scoring_dimension_ratings = {(candidacy_id, sd[0]): 50.0
+                                 for candidacy_id in candidate_ids for sd in scoring_dimension_rows
+                                 if rng.random() < 0.66}
+    user_id_index = generate_report.CANDIDACY_FIELDS.index("e_candidacies.user_id")
+    custom_field_answers = {(candidacy[user_id_index], custom_field[0]): "answer"
+                            for candidacy in candidacies for custom_field in layout.custom_fields
+                            if rng.random() < 0.66}
+    return layout, candidacies, (metrics, user_assessments, scoring_dimension_ratings, custom_field_answers)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time ReportPlan.build_row alone, on an in-memory batch (no database).")
+    parser.add_argument("--rows", type=int, default=100000, help="candidacies in the batch")
+    parser.add_argument("--assessments", type=int, default=5,
+                        help="pipeline assessments (as many non-pipeline ones are added)")
+    parser.add_argument("--scoring-dimensions", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the batch; the fastest one is kept")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    args = parser.parse_args()
+
+    layout, candidacies, lookups = build_batch(args.rows, args.assessments, args.scoring_dimensions, args.seed)
+    build_row = layout.plan.build_row
+    timings = []
+    for _ in range(args.repeat):
+        started_at = time.perf_counter()
+        for candidacy in candidacies:
+            build_row(candidacy, "Job", *lookups)
+        timings.append(time.perf_counter() - started_at)
+    best = min(timings)
+    print(f"{args.rows} rows of {len(layout.headers)} columns in {best:.3f}s: {args.rows / best:,.0f} rows/s "
+          f"({best / args.rows * 1e6:.2f} us/row)")
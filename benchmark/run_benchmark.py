@@ -0,0 +1,290 @@
+# -*- coding:utf-8 -*-
+import argparse
+import asyncio
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import psycopg2
+import psycopg2.extensions
+from concurrent.futures.process import ProcessPoolExecutor
+from concurrent.futures.thread import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_report  # noqa: E402
+from seed_data import add_connection_arguments, add_scale_arguments, create_database, drop_database, generate  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# generate_report.py options each scenario runs with
+SCENARIOS = {
+    "default": {},
+    "stream": {"stream": True},
+    "range": {"range_mode": True},
+    "range_stream": {"range_mode": True, "stream": True},
+    "copy": {"copy": True},
+    "staging": {"staging": True},
+    # --engine async
+    "async": {"engine": "async"},
+    "async_stream": {"engine": "async", "stream": True},
+}
+
+# metrics compared against the baseline; all of them are better when lower
+COMPARED_METRICS = ["wall_s", "queries", "peak_rss_mb"]
+
+BENCH_SECTION = "bench"
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    # counts every statement run through the benchmarked pool (named cursors included)
+    queries = 0
+    lock = threading.Lock()
+
+    def execute(self, query, vars=None):
+        with CountingCursor.lock:
+            CountingCursor.queries += 1
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        with CountingCursor.lock:
+            CountingCursor.queries += 1
+        return super().copy_expert(sql, file, size)
+
+
+def run_threaded_jobs(config_path, out_dir, options, workers):
+    # the run_org part of an org run: JobCandidates jobs on a JobScheduler over a counted psycopg2 pool
+    range_mode = options.get("range_mode", False)
+    with generate_report.OrgContext(BENCH_SECTION, config_path=config_path,
+                                    cursor_factory=CountingCursor) as context, \
+            ThreadPoolExecutor(max_workers=cpu_count()) as exe:
+        plan = context.get_work_plan(generate_report.REPORT_START, generate_report.REPORT_END)
+        if options.get("staging"):
+            context.stage_candidacy_metrics(generate_report.REPORT_START, generate_report.REPORT_END)
+        jobs, _ = generate_report.schedule_jobs(
+            BENCH_SECTION, plan, out_dir, range_mode,
+            lambda start_date, end_date: generate_report.JobCandidates(start_date=start_date,
+                                                                       end_date=end_date,
+                                                                       org=BENCH_SECTION,
+                                                                       context=context,
+                                                                       stream=options.get("stream", False),
+                                                                       executor=exe,
+                                                                       copy=options.get("copy", False)))
+        return generate_report.JobScheduler(min(workers or context.job_slots, context.job_slots)).run(jobs)
+
+
+async def run_async_jobs(config_path, out_dir, options, workers, profile):
+    # the run_org_async part of an org run: AsyncJobCandidates coroutines, at most `workers` at a time
+    range_mode = options.get("range_mode", False)
+    async with generate_report.AsyncOrgContext(BENCH_SECTION, config_path=config_path, profile=profile) as context:
+        plan = await context.get_work_plan(generate_report.REPORT_START, generate_report.REPORT_END)
+        if options.get("staging"):
+            await context.stage_candidacy_metrics(generate_report.REPORT_START, generate_report.REPORT_END)
+        jobs, _ = generate_report.schedule_jobs(
+            BENCH_SECTION, plan, out_dir, range_mode,
+            lambda start_date, end_date: generate_report.AsyncJobCandidates(start_date=start_date,
+                                                                            end_date=end_date,
+                                                                            org=BENCH_SECTION,
+                                                                            context=context,
+                                                                            stream=options.get("stream", False)))
+        job_slots = asyncio.Semaphore(min(workers or context.job_slots, context.job_slots))
+
+        async def run_job(job):
+            async with job_slots:
+                try:
+                    return job, await job.fn(*job.args), None
+                except Exception:
+                    return job, None, traceback.format_exc()
+
+        return await asyncio.gather(*[run_job(job) for job in jobs])
+
+
+def run_scenario(config_path, out_dir, options, workers=None):
+    # one end-to-end org run (work plan, JobScheduler, JobCandidates.process/process_range) in a fresh
+    # process, so peak RSS and the metadata cache belong to this scenario alone
+    range_mode = options.get("range_mode", False)
+    started_at = time.perf_counter()
+    # the async engine has no psycopg2 cursors to count: its statements are counted by a QueryProfile
+    profile = generate_report.QueryProfile(BENCH_SECTION) if options.get("engine") == "async" else None
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if profile is not None:
+            results = asyncio.run(run_async_jobs(config_path, out_dir, options, workers, profile))
+        else:
+            results = run_threaded_jobs(config_path, out_dir, options, workers)
+    wall_s = time.perf_counter() - started_at
+
+    summary = {"org": BENCH_SECTION, "reports": 0, "rows": 0, "error": None}
+    generate_report.add_job_results(summary, results, range_mode)
+    if summary["error"]:
+        raise RuntimeError(f"{summary['error']}:\n" + "\n".join(error for _, _, error in results if error))
+    queries = CountingCursor.queries if profile is None else sum(
+        len(stats[0]) for stats in profile.templates.values())
+    return {
+        "wall_s": round(wall_s, 3),
+        "queries": queries,
+        "reports": summary["reports"],
+        "rows": summary["rows"],
+        "rows_per_s": round(summary["rows"] / wall_s, 1) if wall_s else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+# report columns computed from the clock when the row is built, so they differ between any two runs
+CLOCK_COLUMNS = ["hours_since_application"]
+
+
+def read_report(path):
+    # csv rows of a report with the CLOCK_COLUMNS cells blanked
+    with open(path, newline="") as report:
+        rows = list(csv.reader(report))
+    masked = [idx for idx, header in enumerate(rows[0] if rows else []) if header in CLOCK_COLUMNS]
+    for row in rows[1:]:
+        for idx in masked:
+            if idx < len(row):
+                row[idx] = ""
+    return rows
+
+
+def diff_reports(reference_dir, out_dir):
+    # report files (relative paths) missing from either run or with different cells
+    def report_files(root):
+        return {os.path.relpath(os.path.join(folder, name), root)
+                for folder, _, names in os.walk(root) for name in names}
+
+    reference, current = report_files(reference_dir), report_files(out_dir)
+    differing = sorted(reference ^ current)
+    for path in sorted(reference & current):
+        if read_report(os.path.join(reference_dir, path)) != read_report(os.path.join(out_dir, path)):
+            differing.append(path)
+    return differing
+
+
+def write_config(path, dbname, args):
+    with open(path, "w") as config:
+        config.write(f"[{BENCH_SECTION}]\n"
+                     f"DBNAME={dbname}\nUSER={args.user}\nPASSWORD={args.password}\n"
+                     f"HOST={args.host}\nPORT={args.port}\n")
+
+
+def scale_key(args):
+    return f"orgs={args.orgs},jobs={args.jobs},candidacies={args.candidacies},assessments={args.assessments}," \
+           f"seed={args.seed}"
+
+
+def compare(results, baseline, tolerance):
+    # prints the change against the baseline; returns the (scenario, metric) pairs worse than tolerance
+    regressions = []
+    print(f"{'scenario':<14} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for scenario, metrics in results.items():
+        if scenario not in baseline:
+            print(f"{scenario:<14} (no baseline)")
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = baseline[scenario][metric], metrics[metric]
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            if change > tolerance:
+                regressions.append((scenario, metric))
+                flag = "  REGRESSION"
+            print(f"{scenario:<14} {metric:<12} {before:>10} {after:>10} {change:>+8.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark generate_report.py end to end on a throwaway database of synthetic data.")
+    add_scale_arguments(parser)
+    add_connection_arguments(parser)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=["default", "stream", "range"],
+                        help="generate_report.py modes to run (default always runs first: the reports of the "
+                             "others are diffed against its reports)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="reports generated at once (default: as run_org, half the pool)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario; the fastest one is kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the baseline for this scale")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative increase of a metric reported as a regression")
+    parser.add_argument("--keep-db", action="store_true", help="leave the synthetic database in place")
+    args = parser.parse_args()
+
+    connect_options = {"host": args.host, "port": args.port, "user": args.user, "password": args.password}
+    dbname = f"report_bench_{os.getpid()}"
+    work_dir = tempfile.mkdtemp(prefix="report_bench_")
+    config_path = os.path.join(work_dir, "config.ini")
+    write_config(config_path, dbname, args)
+
+    # default first, so its reports are there to diff the other scenarios against
+    scenarios = ["default"] + [scenario for scenario in args.scenarios if scenario != "default"]
+
+    results = {}
+    mismatches = {}
+    try:
+        seeded_at = time.perf_counter()
+        create_database(dbname, **connect_options)
+        conn = psycopg2.connect(dbname=dbname, **connect_options)
+        counts = generate(conn, args.orgs, args.jobs, args.candidacies, args.assessments, args.seed)
+        conn.close()
+        print(f"Seeded {dbname} ({scale_key(args)}): {counts['e_candidacies']} candidacies, "
+              f"{sum(counts.values())} rows in {time.perf_counter() - seeded_at:.1f}s")
+
+        # spawn: every scenario starts from a clean interpreter
+        mp_context = multiprocessing.get_context("spawn")
+        reference_dir = None
+        for scenario in scenarios:
+            runs = []
+            for _ in range(args.repeat):
+                out_dir = tempfile.mkdtemp(dir=work_dir)
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as exe:
+                    runs.append(exe.submit(run_scenario, config_path, out_dir, SCENARIOS[scenario],
+                                           args.workers).result())
+                if scenario == "default" and reference_dir is None:
+                    reference_dir = out_dir
+                    continue
+                mismatches[scenario] = diff_reports(reference_dir, out_dir)
+                shutil.rmtree(out_dir)
+            results[scenario] = min(runs, key=lambda run: run["wall_s"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not args.keep_db:
+            drop_database(dbname, **connect_options)
+
+    print(f"{'scenario':<14} {'wall_s':>8} {'queries':>8} {'reports':>8} {'rows':>8} {'rows/s':>10} {'rss_mb':>8}")
+    for scenario, metrics in results.items():
+        print(f"{scenario:<14} {metrics['wall_s']:>8} {metrics['queries']:>8} {metrics['reports']:>8} "
+              f"{metrics['rows']:>8} {metrics['rows_per_s']:>10} {metrics['peak_rss_mb']:>8}")
+
+    for scenario, differing in mismatches.items():
+        if differing:
+            print(f"{scenario}: {len(differing)} reports differ from the default scenario's, e.g. {differing[:5]}")
+        else:
+            print(f"{scenario}: same reports as the default scenario")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baselines = json.load(baseline_file)
+    if args.save_baseline:
+        baselines.setdefault(scale_key(args), {}).update(results)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Saved baseline for {scale_key(args)} to {args.baseline}")
+    elif scale_key(args) in baselines:
+        if compare(results, baselines[scale_key(args)], args.tolerance):
+            sys.exit(1)
+    else:
+        print(f"No baseline for {scale_key(args)}; store one with --save-baseline")
+    if any(mismatches.values()):
+        sys.exit(1)
@@ -0,0 +1,267 @@
+# -*- coding:utf-8 -*-
+import argparse
+import csv
+import io
+import random
+import psycopg2
+from datetime import datetime, timedelta
+
+# the e_* tables (and columns) generate_report.py reads, as in the production dumps
+SCHEMA_SQL = """
+    CREATE TABLE e_candidacies(id bigint PRIMARY KEY, user_id bigint, job_id bigint, pipeline_stage_id bigint,
+        added_to_stage_at timestamp, score numeric, possible_score numeric, weighted_percentage_score numeric,
+        archive_reason text, parent_candidacy_id bigint, status text, progress text, failed boolean,
+        withdraw_reason text, percentile numeric, completed_user_assessments int, scoring_completed boolean,
+        external_job_id text, remaining_assessment_count int, created_at timestamp, updated_at timestamp);
+    CREATE TABLE e_pipeline_stages(id bigint PRIMARY KEY, name text, sequence int, slug text, job_id bigint,
+        maintain_anonymity boolean, type text, created_at timestamp, updated_at timestamp);
+    CREATE TABLE e_users(id bigint PRIMARY KEY, email text, first_name text, middle_name text, last_name text,
+        country_code text, phone text, created_at timestamp, updated_at timestamp);
+    CREATE TABLE e_jobs(id bigint PRIMARY KEY, name text, organization_id bigint, created_at timestamp,
+        updated_at timestamp);
+    CREATE TABLE e_custom_fields(id bigint PRIMARY KEY, organization_id bigint, name text, slug text, type text);
+    CREATE TABLE e_questions(id bigint PRIMARY KEY, custom_field_id bigint);
+    CREATE TABLE e_answers(id bigint PRIMARY KEY, question_id bigint, user_id bigint, value text,
+        created_at timestamp, updated_at timestamp);
+    CREATE TABLE e_assessments(id bigint PRIMARY KEY, name text, type text, slug text, created_at timestamp,
+        updated_at timestamp);
+    CREATE TABLE e_job_assessments(id bigint PRIMARY KEY, job_id bigint, assessment_id bigint, sequence int);
+    CREATE TABLE e_user_assessments(id bigint PRIMARY KEY, user_id bigint, assessment_id bigint,
+        percentage_score numeric, started_at timestamp, completed_at timestamp, created_at timestamp,
+        updated_at timestamp);
+    CREATE TABLE e_steps(id bigint PRIMARY KEY, assessment_id bigint);
+    CREATE TABLE e_scoring_rules(id bigint PRIMARY KEY, step_id bigint, scoring_dimension_id bigint);
+    CREATE TABLE e_scoring_dimensions(id bigint PRIMARY KEY, name text, organization_id bigint);
+    CREATE TABLE e_scoring_dimension_ratings(id bigint PRIMARY KEY, candidacy_id bigint,
+        scoring_dimension_id bigint, percentage_score numeric, created_at timestamp, updated_at timestamp);
+    CREATE TABLE e_tags(id bigint PRIMARY KEY, name text);
+    CREATE TABLE e_candidacy_tags(id bigint PRIMARY KEY, candidacy_id bigint, tag_id bigint);
+    CREATE TABLE e_events(id bigint PRIMARY KEY, candidacy_id bigint, type text, created_at timestamp,
+        updated_at timestamp);
+    CREATE TABLE e_calendar_events(id bigint PRIMARY KEY, candidacy_id bigint, start_datetime timestamp,
+        created_at timestamp, updated_at timestamp);
+"""
+
+# foreign key indexes the dumps come with; created after loading
+INDEX_SQL = """
+    CREATE INDEX ON e_candidacies(job_id, created_at);
+    CREATE INDEX ON e_candidacies(user_id);
+    CREATE INDEX ON e_pipeline_stages(job_id);
+    CREATE INDEX ON e_job_assessments(job_id);
+    CREATE INDEX ON e_user_assessments(user_id);
+    CREATE INDEX ON e_steps(assessment_id);
+    CREATE INDEX ON e_scoring_rules(step_id);
+    CREATE INDEX ON e_scoring_dimension_ratings(candidacy_id);
+    CREATE INDEX ON e_candidacy_tags(candidacy_id);
+    CREATE INDEX ON e_events(candidacy_id);
+    CREATE INDEX ON e_calendar_events(candidacy_id);
+    CREATE INDEX ON e_questions(custom_field_id);
+    CREATE INDEX ON e_answers(question_id);
+    CREATE INDEX ON e_answers(user_id);
+"""
+
+# candidacies are spread over the months generate_report.py reports on
+DATA_START = datetime(2019, 10, 1, 0, 0)
+DATA_END = datetime(2021, 1, 1, 0, 0)
+
+STEPS_PER_ASSESSMENT = 2
+CUSTOM_FIELDS_PER_ORG = 2
+COPY_BATCH = 50000
+
+TAGS = ["hot", "cold", "rehire", "referral"]
+EVENT_TYPES = ["email", "sms", "note"]
+ANSWERS = ["", "red", "blue", "42", "yes", "no"]
+
+
+class TableWriter:
+    # buffers rows of one table and loads them with COPY FROM every COPY_BATCH rows
+    def __init__(self, cur, table):
+        self.cur = cur
+        self.table = table
+        self.buffer = io.StringIO()
+        self.csv_write = csv.writer(self.buffer)
+        self.pending = 0
+        self.rows = 0
+
+    def add(self, row):
+        self.csv_write.writerow(["" if value is None else value for value in row])
+        self.pending += 1
+        self.rows += 1
+        if self.pending >= COPY_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.buffer.seek(0)
+            self.cur.copy_expert(f"COPY {self.table} FROM STDIN WITH CSV", self.buffer)
+            self.buffer = io.StringIO()
+            self.csv_write = csv.writer(self.buffer)
+            self.pending = 0
+
+
+def generate(conn, orgs=2, jobs=5, candidacies=200, assessments=3, seed=7):
+    # fills an empty database with `orgs` organizations of `jobs` jobs each, `candidacies` candidacies per
+    # job and `assessments` pipeline assessments per job (each org has twice as many, the rest are taken
+    # outside the pipeline); the same arguments always produce the same rows. Returns rows per table
+    rng = random.Random(seed)
+    cur = conn.cursor()
+    cur.execute(SCHEMA_SQL)
+    writers = {}
+
+    def add(table, row):
+        writer = writers.get(table)
+        if writer is None:
+            writer = writers[table] = TableWriter(cur, table)
+        writer.add(row)
+
+    span = int((DATA_END - DATA_START).total_seconds())
+
+    def timestamp():
+        return DATA_START + timedelta(seconds=rng.randrange(span))
+
+    for tag_id, name in enumerate(TAGS, 1):
+        add("e_tags", (tag_id, name))
+
+    ids = {}
+
+    def next_id(table):
+        ids[table] = ids.get(table, 0) + 1
+        return ids[table]
+
+    for org_id in range(1, orgs + 1):
+        # assessments, steps and scoring rules of the org; scoring dimension ids follow the rule ids, which
+        # is what the reports look dimensions up by
+        org_assessments = []
+        org_rules = {}
+        for _ in range(assessments * 2):
+            assessment_id = next_id("e_assessments")
+            org_assessments.append(assessment_id)
+            add("e_assessments", (assessment_id, f"Assessment {assessment_id}", "quiz", f"assessment-{assessment_id}",
+                                  DATA_START, DATA_START))
+            for _ in range(STEPS_PER_ASSESSMENT):
+                step_id = next_id("e_steps")
+                rule_id = next_id("e_scoring_rules")
+                add("e_steps", (step_id, assessment_id))
+                add("e_scoring_rules", (rule_id, step_id, rule_id))
+                add("e_scoring_dimensions", (rule_id, f"Dimension {rule_id}", org_id))
+                org_rules.setdefault(assessment_id, []).append(rule_id)
+
+        for _ in range(CUSTOM_FIELDS_PER_ORG):
+            custom_field_id = next_id("e_custom_fields")
+            add("e_custom_fields", (custom_field_id, org_id, f"Field {custom_field_id}", f"field-{custom_field_id}",
+                                    "text"))
+            add("e_questions", (custom_field_id, custom_field_id))
+
+        for _ in range(jobs):
+            job_id = next_id("e_jobs")
+            add("e_jobs", (job_id, f"Job {job_id} / Org {org_id}", org_id, DATA_START, DATA_START))
+            stages = []
+            for sequence in range(3):
+                stage_id = next_id("e_pipeline_stages")
+                stages.append(stage_id)
+                add("e_pipeline_stages", (stage_id, f"Stage {sequence}", sequence, f"stage-{sequence}", job_id,
+                                          False, "default", DATA_START, DATA_START))
+            for sequence, assessment_id in enumerate(rng.sample(org_assessments, assessments)):
+                add("e_job_assessments", (next_id("e_job_assessments"), job_id, assessment_id, sequence))
+
+            for _ in range(candidacies):
+                user_id = next_id("e_users")
+                candidacy_id = next_id("e_candidacies")
+                created_at = timestamp()
+                add("e_users", (user_id, f"user{user_id}@example.com", f"First{user_id}", None, f"Last{user_id}",
+                                "CA", "5550100", created_at, created_at))
+                add("e_candidacies", (candidacy_id, user_id, job_id, rng.choice(stages), created_at,
+                                      rng.randint(0, 100), 100, round(rng.random(), 4), None, None, "active",
+                                      "in_progress", rng.random() < 0.3, None, rng.randint(1, 99), 0, True, None,
+                                      rng.randint(0, 3), created_at, created_at))
+                for assessment_id in org_assessments:
+                    if rng.random() < 0.6:
+                        # some users take an assessment twice, with a rating per attempt: the reports pick one
+                        # of several rows per (candidacy, assessment) and (candidacy, dimension)
+                        for attempt in range(2 if rng.random() < 0.15 else 1):
+                            started_at = created_at + timedelta(hours=1 + 24 * attempt)
+                            completed_at = started_at + timedelta(hours=1) if rng.random() < 0.7 else None
+                            add("e_user_assessments", (next_id("e_user_assessments"), user_id, assessment_id,
+                                                       rng.randint(0, 100), started_at, completed_at,
+                                                       started_at, completed_at or started_at))
+                            for rule_id in org_rules[assessment_id]:
+                                add("e_scoring_dimension_ratings", (next_id("e_scoring_dimension_ratings"),
+                                                                    candidacy_id, rule_id, rng.randint(0, 100),
+                                                                    started_at, started_at))
+                # up to three tags and two calendar events per candidacy (the reports show one of each)
+                if rng.random() < 0.4:
+                    for tag_id in rng.sample(range(1, len(TAGS) + 1), rng.randint(1, min(3, len(TAGS)))):
+                        add("e_candidacy_tags", (next_id("e_candidacy_tags"), candidacy_id, tag_id))
+                for _ in range(rng.randint(0, 6)):
+                    event_at = created_at + timedelta(hours=rng.randint(1, 500))
+                    add("e_events", (next_id("e_events"), candidacy_id, rng.choice(EVENT_TYPES), event_at, event_at))
+                if rng.random() < 0.3:
+                    for _ in range(rng.randint(1, 2)):
+                        start_at = created_at + timedelta(days=rng.randint(1, 20))
+                        add("e_calendar_events", (next_id("e_calendar_events"), candidacy_id, start_at, created_at,
+                                                  created_at))
+                for offset in range(CUSTOM_FIELDS_PER_ORG):
+                    if rng.random() < 0.7:
+                        question_id = ids["e_custom_fields"] - offset
+                        add("e_answers", (next_id("e_answers"), question_id, user_id, rng.choice(ANSWERS),
+                                          created_at, created_at))
+
+    for writer in writers.values():
+        writer.flush()
+    cur.execute(INDEX_SQL)
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE;")
+    conn.autocommit = False
+    cur.close()
+    return {table: writer.rows for table, writer in writers.items()}
+
+
+def create_database(dbname, **connect_options):
+    conn = psycopg2.connect(dbname="postgres", **connect_options)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS {dbname};")
+    cur.execute(f"CREATE DATABASE {dbname} ENCODING 'UTF8' TEMPLATE template0;")
+    cur.close()
+    conn.close()
+
+
+def drop_database(dbname, **connect_options):
+    conn = psycopg2.connect(dbname="postgres", **connect_options)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS {dbname};")
+    cur.close()
+    conn.close()
+
+
+def add_scale_arguments(parser):
+    parser.add_argument("--orgs", type=int, default=2, help="organizations")
+    parser.add_argument("--jobs", type=int, default=5, help="jobs per organization")
+    parser.add_argument("--candidacies", type=int, default=200, help="candidacies per job")
+    parser.add_argument("--assessments", type=int, default=3, help="pipeline assessments per job")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+
+
+def add_connection_arguments(parser):
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a database of seeded synthetic e_* data.")
+    parser.add_argument("dbname", help="database to (re)create")
+    add_scale_arguments(parser)
+    add_connection_arguments(parser)
+    args = parser.parse_args()
+
+    connect_options = {"host": args.host, "port": args.port, "user": args.user, "password": args.password}
+    create_database(args.dbname, **connect_options)
+    conn = psycopg2.connect(dbname=args.dbname, **connect_options)
+    counts = generate(conn, args.orgs, args.jobs, args.candidacies, args.assessments, args.seed)
+    conn.close()
+    for table, rows in sorted(counts.items()):
+        print(f"{table:<32} {rows}")
@@ -1,80 +1,1979 @@
 # -*- coding:utf-8 -*-
+import argparse
+import asyncio
+import io
+import json
 import pathlib
 import os
 import csv
+import gzip
+import hashlib
+import pickle
 import re
+import socket
+import sqlite3
 import unicodedata
+import sys
+import time
+import traceback
+import threading
+import itertools
+import math
+import operator
+import uuid
+import weakref
+import zlib
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
 from configparser import ConfigParser
 from psycopg2.pool import ThreadedConnectionPool
 
 
+from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
 from multiprocessing import cpu_count
 
+try:
+    # only needed by --engine async
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    # only needed by --format parquet / arrow
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    # only needed by --format csv.zst
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the e_candidacies, e_pipeline_stages and e_users columns the reports read (see ReportPlan), in select-list
+# order; the candidacy queries project only these
 CANDIDACY_FIELDS = [
     "e_candidacies.id",
     "e_candidacies.user_id",
-    "e_candidacies.job_id",
-    "e_candidacies.pipeline_stage_id",
-    "e_candidacies.added_to_stage_at",
-    "e_candidacies.score",
-    "e_candidacies.possible_score",
     "e_candidacies.weighted_percentage_score",
-    "e_candidacies.archive_reason",
-    "e_candidacies.parent_candidacy_id",
     "e_candidacies.status",
-    "e_candidacies.progress",
     "e_candidacies.failed",
-    "e_candidacies.withdraw_reason",
     "e_candidacies.percentile",
-    "e_candidacies.completed_user_assessments",
-    "e_candidacies.scoring_completed",
-    "e_candidacies.external_job_id",
     "e_candidacies.remaining_assessment_count",
     "e_candidacies.created_at",
-    "e_candidacies.updated_at",
-    "e_pipeline_stages.id",
     "e_pipeline_stages.name",
-    "e_pipeline_stages.sequence",
-    "e_pipeline_stages.slug",
-    "e_pipeline_stages.job_id",
-    "e_pipeline_stages.maintain_anonymity",
-    "e_pipeline_stages.type",
-    "e_pipeline_stages.created_at",
-    "e_pipeline_stages.updated_at",
     "e_users.id",
     "e_users.email",
     "e_users.first_name",
-    "e_users.middle_name",
     "e_users.last_name",
     "e_users.country_code",
     "e_users.phone",
-    "e_users.created_at",
-    "e_users.updated_at",
 ]
+CANDIDACY_FIELD_INDEX = {field: idx for idx, field in enumerate(CANDIDACY_FIELDS)}
+
+# connection pool bounds per org, overridable with POOL_MIN / POOL_MAX in the config.ini section
+DEFAULT_POOL_MIN = 16
+DEFAULT_POOL_MAX = 80
+
+# adaptive limit on the queries an org runs at once (see QueryLimit), per config.ini section: QUERY_LIMIT_MIN and
+# QUERY_LIMIT_MAX bound it (the ceiling defaults to, and never exceeds, POOL_MAX; it starts at POOL_MIN) and
+# LATENCY_TOLERANCE is the slowdown over the baseline latency at which it backs off
+DEFAULT_QUERY_LIMIT_MIN = 2
+DEFAULT_LATENCY_TOLERANCE = 2.0
+# queries per adjustment of the limit, at least (a window is max(limit, QUERY_LIMIT_WINDOW) queries)
+QUERY_LIMIT_WINDOW = 10
+# seconds between the query limit lines of the run log
+QUERY_LIMIT_LOG_SECONDS = 10
+
+# monthly report folders cover [REPORT_START, REPORT_END)
+REPORT_START = datetime(2019, 10, 1, 0, 0)
+REPORT_END = datetime(2021, 1, 1, 0, 0)
+
+# connections one process()/process_range() call holds at the same time
+CONNECTIONS_PER_JOB = 2
+
+# rows fetched per round trip by server-side (named) cursors
+CURSOR_ITERSIZE = 10000
+
+# rows built but not yet written per report in stream mode
+ROW_WINDOW = 1000
+
+# rows per record batch (Parquet row group) of the columnar sinks
+ROW_GROUP_ROWS = 10000
+
+# completed reports of every run, next to reports/ (see RunManifest)
+MANIFEST_NAME = "reports_manifest.jsonl"
+
+# work-queue mode (--queue, see WorkQueue): a claimed task is leased for QUEUE_LEASE_SECONDS, renewed by the
+# worker's heartbeat every third of that, and tried at most QUEUE_MAX_ATTEMPTS times; a worker with nothing to
+# claim while other tasks are leased looks again every QUEUE_POLL_SECONDS, to pick up expired leases
+QUEUE_LEASE_SECONDS = 300
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_POLL_SECONDS = 10
+# --query-cache (see QueryCache): default size of the cache file, past which the least recently used results go
+# until QUERY_CACHE_EVICT_TO of it is left; results over QUERY_CACHE_MAX_RESULT_KB compressed are not stored;
+# hits are recorded for the LRU order in batches of QUERY_CACHE_TOUCH_BATCH
+QUERY_CACHE_MB = 512
+QUERY_CACHE_EVICT_TO = 0.9
+QUERY_CACHE_MAX_RESULT_KB = 1024
+QUERY_CACHE_TOUCH_BATCH = 100
+# version of the report contents, recorded in the manifest; bumped when the same data gives different files
+# (2: one column per custom field with each candidate's own answer), so older reports are regenerated
+REPORT_FORMAT = 2
+
+# defaults for candidacies without any tag, event or calendar rows
+EMPTY_CANDIDACY_METRICS = {
+    "tags": "",
+    "assessments_completed": 0,
+    "email_messages_count": 0,
+    "sms_messages_count": 0,
+    "last_email_created_at": "",
+    "last_sms_created_at": "",
+    "calendar_events": "",
+}
+
+# queries shared by the threaded (JobCandidates) and asyncio (AsyncJobCandidates) engines; %s placeholders,
+# converted by to_dollar_params for asyncpg
+SELECT_JOBS_SQL = """
+            SELECT id, name 
+            FROM e_jobs
+            ORDER BY created_at
+        """
+
+# candidacies per (job, month) and their source watermark: the latest updated_at over the candidacies and
+# their user assessments, custom field answers, events and scoring dimension ratings. The window's candidacies
+# are read once; each source table is then aggregated in one grouped pass per (job, month) and joined back
+# (max of greatest = greatest of the maxes, both skipping NULLs)
+SELECT_ACTIVITY_SQL = """
+            WITH window_c AS (
+                SELECT e_candidacies.id, e_candidacies.user_id, e_candidacies.job_id,
+                    date_trunc('month', e_candidacies.created_at) AS month, e_candidacies.updated_at
+                FROM e_candidacies
+                INNER JOIN e_users ON e_candidacies.user_id=e_users.id
+                INNER JOIN e_pipeline_stages ON e_pipeline_stages.job_id=e_candidacies.job_id
+                AND e_candidacies.pipeline_stage_id=e_pipeline_stages.id
+                WHERE e_candidacies.created_at >= %s AND e_candidacies.created_at < %s
+            ), candidacies AS (
+                SELECT job_id, month, count(*) AS count, max(updated_at) AS updated_at FROM window_c GROUP BY 1, 2
+            ), ua AS (
+                SELECT c.job_id, c.month, max(ua.updated_at) AS updated_at
+                FROM window_c AS c INNER JOIN e_user_assessments AS ua ON ua.user_id=c.user_id
+                GROUP BY 1, 2
+            ), ans AS (
+                SELECT c.job_id, c.month, max(ans.updated_at) AS updated_at
+                FROM window_c AS c INNER JOIN e_answers AS ans ON ans.user_id=c.user_id
+                GROUP BY 1, 2
+            ), ev AS (
+                SELECT c.job_id, c.month, max(ev.updated_at) AS updated_at
+                FROM window_c AS c INNER JOIN e_events AS ev ON ev.candidacy_id=c.id
+                GROUP BY 1, 2
+            ), sdr AS (
+                SELECT c.job_id, c.month, max(sdr.updated_at) AS updated_at
+                FROM window_c AS c INNER JOIN e_scoring_dimension_ratings AS sdr ON sdr.candidacy_id=c.id
+                GROUP BY 1, 2
+            )
+            SELECT candidacies.job_id, candidacies.month, candidacies.count,
+                greatest(candidacies.updated_at, ua.updated_at, ans.updated_at, ev.updated_at, sdr.updated_at)
+            FROM candidacies
+            LEFT JOIN ua USING (job_id, month)
+            LEFT JOIN ans USING (job_id, month)
+            LEFT JOIN ev USING (job_id, month)
+            LEFT JOIN sdr USING (job_id, month);
+        """
+
+ORG_METADATA_QUERIES = {
+    "organization_ids": "SELECT id, organization_id FROM e_jobs;",
+    "custom_fields": "SELECT DISTINCT * FROM e_custom_fields ORDER BY id;",
+    "custom_field_questions": "SELECT id, custom_field_id FROM e_questions;",
+    "assessments": "SELECT DISTINCT * FROM e_assessments ORDER BY id;",
+    "job_assessments": "SELECT job_id, assessment_id FROM e_job_assessments ORDER BY sequence;",
+    "scoring_dimensions": "SELECT DISTINCT * FROM e_scoring_dimensions ORDER BY id;",
+    "candidacy_columns": """
+            SELECT c.relname, a.attname
+            FROM pg_attribute AS a
+            INNER JOIN pg_class AS c ON c.oid=a.attrelid
+            WHERE a.attrelid = ANY('{e_candidacies,e_users,e_pipeline_stages}'::regclass[])
+            AND a.attnum > 0 AND NOT a.attisdropped;
+        """,
+}
+
+# tags, completed-assessment counts, email/sms events and calendar events of a batch of candidacies,
+# folded by build_candidacy_metrics. Where a candidacy has several rows, every mode (including the staged
+# metrics and report_copy_sql) shows the one with the lowest id
+SELECT_TAGS_NAME_SQL = """
+            SELECT DISTINCT ON (ct.candidacy_id) ct.candidacy_id, t.name
+            FROM e_tags AS t
+            INNER JOIN e_candidacy_tags AS ct ON ct.tag_id=t.id
+            WHERE ct.candidacy_id = ANY(%s)
+            ORDER BY ct.candidacy_id, ct.id;
+        """
+SELECT_ASSESSMENTS_COMPLETED_SQL = """
+            SELECT c.id, count(ua.completed_at)
+            FROM e_candidacies AS c
+            INNER JOIN e_user_assessments AS ua ON c.user_id=ua.user_id
+            WHERE c.id = ANY(%s) AND ua.completed_at IS NOT NULL
+            GROUP BY c.id;
+        """
+# first event by id per (candidacy, type) together with the per-type count
+SELECT_EVENTS_SQL = """
+            SELECT DISTINCT ON (candidacy_id, type)
+                candidacy_id, type, created_at, count(*) OVER (PARTITION BY candidacy_id, type)
+            FROM e_events
+            WHERE candidacy_id = ANY(%s) AND type IN ('email', 'sms')
+            ORDER BY candidacy_id, type, id;
+        """
+SELECT_CALENDAR_EVENTS_SQL = """
+            SELECT DISTINCT ON (candidacy_id) candidacy_id, start_datetime
+            FROM e_calendar_events
+            WHERE candidacy_id = ANY(%s)
+            ORDER BY candidacy_id, id;
+        """
+CANDIDACY_METRICS_QUERIES = [
+    SELECT_TAGS_NAME_SQL,
+    SELECT_ASSESSMENTS_COMPLETED_SQL,
+    SELECT_EVENTS_SQL,
+    SELECT_CALENDAR_EVENTS_SQL,
+]
+
+# --staging: the CANDIDACY_METRICS_QUERIES results of every candidacy of the report range, precomputed
+# once per org run into an unlogged table with one row per candidacy (columns named after the
+# EMPTY_CANDIDACY_METRICS keys; NULL where the candidacy has no row in the source table)
+CREATE_STAGED_METRICS_SQL = """
+            CREATE UNLOGGED TABLE {table} AS
+            SELECT c.id AS candidacy_id,
+                tags.name AS tags,
+                completed.count AS assessments_completed,
+                events.email_messages_count,
+                events.sms_messages_count,
+                events.last_email_created_at,
+                events.last_sms_created_at,
+                calendar.start_datetime AS calendar_events
+            FROM e_candidacies AS c
+            LEFT JOIN (
+                SELECT DISTINCT ON (ct.candidacy_id) ct.candidacy_id, t.name
+                FROM e_tags AS t
+                INNER JOIN e_candidacy_tags AS ct ON ct.tag_id=t.id
+                ORDER BY ct.candidacy_id, ct.id
+            ) AS tags ON tags.candidacy_id=c.id
+            LEFT JOIN (
+                SELECT window_c.id, count(ua.completed_at)
+                FROM e_candidacies AS window_c
+                INNER JOIN e_user_assessments AS ua ON window_c.user_id=ua.user_id
+                WHERE ua.completed_at IS NOT NULL
+                AND window_c.created_at >= '{start_date}' AND window_c.created_at < '{end_date}'
+                GROUP BY window_c.id
+            ) AS completed ON completed.id=c.id
+            LEFT JOIN (
+                -- first event by id per type together with the per-type count
+                SELECT candidacy_id,
+                    count(*) FILTER (WHERE type='email') AS email_messages_count,
+                    count(*) FILTER (WHERE type='sms') AS sms_messages_count,
+                    (array_agg(created_at ORDER BY id) FILTER (WHERE type='email'))[1] AS last_email_created_at,
+                    (array_agg(created_at ORDER BY id) FILTER (WHERE type='sms'))[1] AS last_sms_created_at
+                FROM e_events
+                WHERE type IN ('email', 'sms')
+                GROUP BY candidacy_id
+            ) AS events ON events.candidacy_id=c.id
+            LEFT JOIN (
+                SELECT DISTINCT ON (candidacy_id) candidacy_id, start_datetime
+                FROM e_calendar_events
+                ORDER BY candidacy_id, id
+            ) AS calendar ON calendar.candidacy_id=c.id
+            WHERE c.created_at >= '{start_date}' AND c.created_at < '{end_date}';
+            CREATE UNIQUE INDEX ON {table} (candidacy_id);
+            ANALYZE {table};
+        """
+SELECT_STAGED_METRICS_SQL = """
+            SELECT candidacy_id, tags, assessments_completed, email_messages_count, sms_messages_count,
+                last_email_created_at, last_sms_created_at, calendar_events
+            FROM {table}
+            WHERE candidacy_id = ANY(%s);
+        """
+STAGED_METRIC_KEYS = [
+    "tags",
+    "assessments_completed",
+    "email_messages_count",
+    "sms_messages_count",
+    "last_email_created_at",
+    "last_sms_created_at",
+    "calendar_events",
+]
+
+
+def staging_table_name():
+    # unique per run, so concurrent runs against the same database do not collide
+    return f"report_staged_metrics_{os.getpid()}_{int(time.time())}"
+
+
+# staging tables of runs that were killed before dropping theirs: the ones created more than
+# STAGING_TABLE_MAX_AGE_SECONDS ago (per their staging_table_name) are dropped when an org run stages
+STAGING_TABLE_MAX_AGE_SECONDS = 24 * 3600
+SELECT_STAGING_TABLES_SQL = """
+            SELECT tablename FROM pg_tables
+            WHERE schemaname = current_schema() AND tablename LIKE 'report\\_staged\\_metrics\\_%';
+        """
+
+
+def stale_staging_tables(rows, now):
+    # names of the SELECT_STAGING_TABLES_SQL rows created more than STAGING_TABLE_MAX_AGE_SECONDS before now
+    stale = []
+    for (table,) in rows:
+        created_at = table.rsplit("_", 1)[-1]
+        if created_at.isdigit() and int(created_at) < now - STAGING_TABLE_MAX_AGE_SECONDS:
+            stale.append(table)
+    return stale
+
+
+# a user's first attempt (lowest id) at each assessment, as report_copy_sql
+SELECT_USER_ASSESSMENTS_SQL = """
+            SELECT DISTINCT ON (c.id, ua.assessment_id)
+                c.id, ua.assessment_id, ua.percentage_score, c.score, ua.started_at, ua.completed_at
+            FROM e_candidacies AS c
+            INNER JOIN e_user_assessments AS ua ON c.user_id=ua.user_id
+            WHERE c.id = ANY(%s) AND ua.assessment_id = ANY(%s)
+            ORDER BY c.id, ua.assessment_id, ua.id;
+        """
+
+SELECT_SCORING_RULES_SQL = """
+            SELECT s.assessment_id, sr.id
+            FROM e_steps AS s
+            INNER JOIN e_scoring_rules AS sr ON sr.step_id=s.id
+            WHERE s.assessment_id = ANY(%s);
+        """
+
+# the first rating (lowest id) per candidacy and dimension, as report_copy_sql
+SELECT_SCORING_DIMENSION_RATINGS_SQL = """
+            SELECT DISTINCT ON (candidacy_id, scoring_dimension_id)
+                candidacy_id, scoring_dimension_id, percentage_score
+            FROM e_scoring_dimension_ratings
+            WHERE candidacy_id = ANY(%s) AND scoring_dimension_id = ANY(%s)
+            ORDER BY candidacy_id, scoring_dimension_id, id;
+        """
+
+
+# non-empty answers of a batch of users to the questions of the org's custom fields, oldest first
+SELECT_CUSTOM_FIELD_ANSWERS_SQL = """
+            SELECT user_id, question_id, value
+            FROM e_answers
+            WHERE user_id = ANY(%s) AND question_id = ANY(%s) AND value<>''
+            ORDER BY id;
+        """
+
+
+def csv_value_sql(expression):
+    # text of expression the way csv.writer writes the value psycopg2 returns for it: NULL and '' as an
+    # empty field, booleans as True/False, fractional timestamps with all six digits
+    value = f"({expression})::text"
+    return f"""NULLIF(CASE pg_typeof({expression})
+                        WHEN 'boolean'::regtype THEN initcap({value})
+                        WHEN 'timestamp without time zone'::regtype
+                        THEN CASE WHEN position('.' IN {value}) > 0 THEN rpad({value}, 26, '0') ELSE {value} END
+                        ELSE {value} END, '')"""
+
+
+def to_dollar_params(sql):
+    # psycopg2 style (%s, %%) to asyncpg style ($1, $2, ..., %)
+    counter = itertools.count(1)
+    return re.sub(r"%%|%s", lambda match: "%" if match.group() == "%%" else f"${next(counter)}", sql)
+
+
+class PreparedStatements:
+    # server-side prepared statements for the psycopg2 pools: each %s query template is PREPAREd once per
+    # connection, under a name given to its text, and then run as EXECUTE name (params). Connections are
+    # tracked weakly, so one the pool closes and replaces prepares its statements again on first use
+    def __init__(self):
+        # sql -> name, name -> PREPARE body ($n placeholders)
+        self.names = {}
+        self.statements = {}
+        # connection -> names prepared on it
+        self.prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def name_for(self, sql):
+        with self._lock:
+            name = self.names.get(sql)
+            if name is None:
+                name = self.names[sql] = f"report_statement_{len(self.names) + 1}"
+                self.statements[name] = to_dollar_params(sql)
+            return name
+
+    def prepare(self, cur, name):
+        with self._lock:
+            prepared = self.prepared.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(f"PREPARE {name} AS {self.statements[name]}")
+            prepared.add(name)
+
+    def execute(self, cur, sql, params):
+        name = self.name_for(sql)
+        self.prepare(cur, name)
+        execute_sql = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})"
+        try:
+            cur.execute(execute_sql, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # the session lost its statements (e.g. DISCARD ALL by a pooler): prepare again and retry once
+            cur.connection.rollback()
+            with self._lock:
+                self.prepared.pop(cur.connection, None)
+            self.prepare(cur, name)
+            cur.execute(execute_sql, params)
+
+    def statement_for(self, execute_sql):
+        # the PREPARE body behind an EXECUTE statement, None for anything else
+        match = SQL_EXECUTE_RE.match(execute_sql)
+        return self.statements.get(match.group(1)) if match else None
+
+
+SQL_EXECUTE_RE = re.compile(r"^\s*(?:EXPLAIN \(ANALYZE, BUFFERS\) )?EXECUTE (\w+)")
+PREPARED_STATEMENTS = PreparedStatements()
+
+
+def build_candidacy_metrics(candidate_ids, tags_rows, completed_rows, event_rows, calendar_rows):
+    # candidacy_id -> metrics from the CANDIDACY_METRICS_QUERIES results; candidacies without rows keep
+    # EMPTY_CANDIDACY_METRICS
+    metrics = {candidacy_id: dict(EMPTY_CANDIDACY_METRICS) for candidacy_id in candidate_ids}
+    for candidacy_id, tag_name in tags_rows:
+        metrics[candidacy_id]["tags"] = tag_name or ""
+    for candidacy_id, completed_count in completed_rows:
+        metrics[candidacy_id]["assessments_completed"] = completed_count
+    for candidacy_id, event_type, created_at, count in event_rows:
+        metrics[candidacy_id][f"{event_type}_messages_count"] = count
+        metrics[candidacy_id][f"last_{event_type}_created_at"] = created_at
+    for candidacy_id, start_datetime in calendar_rows:
+        metrics[candidacy_id]["calendar_events"] = start_datetime
+    return metrics
+
+
+def build_staged_candidacy_metrics(candidate_ids, rows):
+    # build_candidacy_metrics for SELECT_STAGED_METRICS_SQL rows
+    metrics = {candidacy_id: dict(EMPTY_CANDIDACY_METRICS) for candidacy_id in candidate_ids}
+    for candidacy_id, *values in rows:
+        metrics[candidacy_id].update(
+            (key, value) for key, value in zip(STAGED_METRIC_KEYS, values) if value is not None
+        )
+    return metrics
+
+
+def build_user_assessment_matrix(assessment_index, rows):
+    # candidacy_id -> row with one (percentage_score, score, started_at, completed_at) slot per assessment,
+    # positioned by assessment_index; None where the user has no user assessment
+    width = len(assessment_index)
+    matrix = {}
+    for candidacy_id, assessment_id, percentage_score, score, started_at, completed_at in rows:
+        row = matrix.get(candidacy_id)
+        if row is None:
+            row = matrix[candidacy_id] = [None] * width
+        row[assessment_index[assessment_id]] = (percentage_score, score, started_at, completed_at)
+    return matrix
+
+
+def build_custom_field_answers(custom_field_ids_by_question, rows):
+    # (user_id, custom_field_id) -> value of the user's latest answer to any question of the custom field
+    answers = {}
+    for user_id, question_id, value in rows:
+        answers[(user_id, custom_field_ids_by_question[question_id])] = value
+    return answers
+
+
+def store_scoring_rule_ids(cache, assessment_ids, rows):
+    resolved = {assessment_id: [] for assessment_id in assessment_ids}
+    for assessment_id, scoring_rule_id in rows:
+        resolved[assessment_id].append(scoring_rule_id)
+    cache.update({assessment_id: tuple(ids) for assessment_id, ids in resolved.items()})
+
+
+class OrgMetadata:
+    # lookup tables of one org database that do not change during a run, built from the ORG_METADATA_QUERIES
+    # results (query name -> rows)
+    def __init__(self, results):
+        # fields: ['id', 'organization_id']
+        self.organization_ids = dict(results["organization_ids"])
+
+        # fields: ['id', 'organization_id', 'name', 'slug', 'type']
+        self.custom_fields = {}
+        for custom_field in results["custom_fields"]:
+            self.custom_fields.setdefault(custom_field[1], []).append(custom_field)
+
+        # fields: ['id', 'custom_field_id']
+        self.custom_field_ids_by_question = dict(results["custom_field_questions"])
+        self.question_ids = {}
+        for question_id, custom_field_id in results["custom_field_questions"]:
+            self.question_ids.setdefault(custom_field_id, []).append(question_id)
+
+        # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
+        self.assessments = {assessment[0]: assessment for assessment in results["assessments"]}
+
+        self.job_assessment_ids = {}
+        for job_id, assessment_id in results["job_assessments"]:
+            if assessment_id in self.assessments:
+                self.job_assessment_ids.setdefault(job_id, set()).add(assessment_id)
+
+        # fields: ['id', 'name', 'organization_id']
+        self.scoring_dimensions = {
+            scoring_dimension[0]: scoring_dimension for scoring_dimension in results["scoring_dimensions"]
+        }
+
+        # assessment_id -> scoring rule ids, filled lazily by resolve_scoring_dimension_ids
+        self.scoring_dimension_ids = {}
+
+        # fields: ['relname', 'attname']; CANDIDACY_FIELDS missing from this database select NULL
+        candidacy_columns = {f"{table}.{column}" for table, column in results["candidacy_columns"]}
+        self.candidacy_select_list = ", ".join(
+            f'{field} AS "{field}"' if field in candidacy_columns else f'NULL AS "{field}"'
+            for field in CANDIDACY_FIELDS
+        )
+        # candidacy field -> position in the candidacy rows, set by read_candidacy_fields
+        self.candidacy_field_index = None
+
+    @classmethod
+    def load(cls, connect_psql):
+        return cls({name: connect_psql(sql) for name, sql in ORG_METADATA_QUERIES.items()})
+
+    def get_assessments(self, assessment_ids):
+        return [self.assessments[idx] for idx in sorted(set(assessment_ids)) if idx in self.assessments]
+
+    def read_candidacy_fields(self, names):
+        # the column names of the first candidacy result of the org (cursor.description); every candidacy query
+        # projects candidacy_select_list, so they hold for the whole run
+        if self.candidacy_field_index is None:
+            self.candidacy_field_index = {name: idx for idx, name in enumerate(names)}
+        return self.candidacy_field_index
+
+    def get_question_ids(self, custom_field_ids):
+        return [question_id for idx in set(custom_field_ids) for question_id in self.question_ids.get(idx, ())]
+
+    def get_scoring_dimensions(self, scoring_dimension_ids):
+        return [
+            self.scoring_dimensions[idx]
+            for idx in sorted(set(scoring_dimension_ids))
+            if idx in self.scoring_dimensions
+        ]
+
+
+class OrgMetadataCache:
+    # LRU of OrgMetadata keyed by org database, shared by every JobCandidates of a run
+    def __init__(self, max_orgs=8):
+        self.max_orgs = max_orgs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, connect_psql):
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is None:
+                metadata = OrgMetadata.load(connect_psql)
+                self._store(key, metadata)
+            else:
+                self._entries.move_to_end(key)
+            return metadata
+
+    def peek(self, key):
+        # the cached metadata or None, for loaders that cannot block on the lock (the async engine)
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is not None:
+                self._entries.move_to_end(key)
+            return metadata
+
+    def put(self, key, metadata):
+        # keeps the metadata already cached for key, if a concurrent loader stored it first
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            return self._store(key, metadata)
+
+    def _store(self, key, metadata):
+        self._entries[key] = metadata
+        while len(self._entries) > self.max_orgs:
+            self._entries.popitem(last=False)
+        return metadata
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def refresh(self, key, connect_psql):
+        self.invalidate(key)
+        return self.get(key, connect_psql)
+
+
+ORG_METADATA_CACHE = OrgMetadataCache()
+
+
+# one (job, month) report with candidacies, as scheduled by OrgContext.get_work_plan
+PlannedReport = namedtuple("PlannedReport", ["job_id", "job_name", "month_start", "candidacies", "watermark"])
+
+
+def next_month(date):
+    if date.month == 12:
+        return date.replace(month=1, year=date.year + 1)
+    return date.replace(month=date.month + 1)
+
+
+# one unit of work for JobScheduler; size orders the work, largest first
+ScheduledJob = namedtuple("ScheduledJob", ["size", "label", "fn", "args"])
+
+
+class JobScheduler:
+    # runs ScheduledJobs on a fixed number of threads: jobs are dealt largest-first onto per-worker queues
+    # (each to the least loaded one); a worker takes its own largest job, and once its queue is empty it
+    # steals the smallest job of the worker with the most work left
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+
+    def run(self, jobs):
+        queues = [deque() for _ in range(self.workers)]
+        remaining = [0] * self.workers
+        for job in sorted(jobs, key=lambda job: -job.size):
+            idx = remaining.index(min(remaining))
+            queues[idx].append(job)
+            remaining[idx] += job.size
+        lock = threading.Lock()
+        results = []
+
+        def next_job(idx):
+            with lock:
+                if queues[idx]:
+                    job = queues[idx].popleft()
+                    remaining[idx] -= job.size
+                    return job
+                victim = max(range(self.workers), key=lambda other: (len(queues[other]) > 0, remaining[other]))
+                if not queues[victim]:
+                    return None
+                job = queues[victim].pop()
+                remaining[victim] -= job.size
+                return job
+
+        def work(idx):
+            while True:
+                job = next_job(idx)
+                if job is None:
+                    return
+                try:
+                    result = job.fn(*job.args)
+                except Exception:
+                    print(f"FAILED {job.label}\n{traceback.format_exc()}")
+                    with lock:
+                        results.append((job, None, traceback.format_exc()))
+                else:
+                    with lock:
+                        results.append((job, result, None))
+
+        threads = [threading.Thread(target=work, args=(idx,), daemon=True) for idx in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+class RunManifest:
+    # the reports finished by earlier runs: one JSON line per (org, month, job) with its path, row count,
+    # candidacies and source watermark, appended (and fsynced) as each report is renamed into place. Later
+    # lines win; a line torn by a crash is ignored. Worker processes append to the same file
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as manifest:
+                for line in manifest:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[(entry["org"], entry["month"], entry["job_id"])] = entry
+
+    def is_current(self, org, item, path):
+        # done in the current format with the same candidacies and watermark, and the report is still there
+        entry = self.entries.get((org, datetime.strftime(item.month_start, '%Y-%m'), item.job_id))
+        return (entry is not None
+                and entry.get("format", 1) == REPORT_FORMAT
+                and entry["candidacies"] == item.candidacies
+                and entry["watermark"] == watermark_text(item.watermark)
+                and entry["path"] == os.path.relpath(path, self.root)
+                and os.path.exists(path))
+
+    def record(self, org, item, path, rows):
+        entry = {
+            "org": org,
+            "month": datetime.strftime(item.month_start, '%Y-%m'),
+            "job_id": item.job_id,
+            "path": os.path.relpath(path, self.root),
+            "rows": rows,
+            "candidacies": item.candidacies,
+            "watermark": watermark_text(item.watermark),
+            "format": REPORT_FORMAT,
+            "finished_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            with open(self.path, "a") as manifest:
+                manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+                os.fsync(manifest.fileno())
+            self.entries[(entry["org"], entry["month"], entry["job_id"])] = entry
+
+
+def watermark_text(watermark):
+    return watermark.isoformat() if watermark is not None else None
+
+
+CREATE_QUEUE_SQL = """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                org TEXT NOT NULL,
+                month TEXT NOT NULL,
+                job_id INTEGER NOT NULL,
+                job_name TEXT NOT NULL,
+                candidacies INTEGER NOT NULL,
+                watermark TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                rows INTEGER,
+                error TEXT,
+                finished_at TEXT,
+                UNIQUE (org, month, job_id)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (status, candidacies);
+        """
+# a task is (re)queued unless it is running, or done with the same candidacies and watermark (last ?: force)
+UPSERT_TASK_SQL = """
+            INSERT INTO tasks (org, month, job_id, job_name, candidacies, watermark) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (org, month, job_id) DO UPDATE SET
+                job_name=excluded.job_name, candidacies=excluded.candidacies, watermark=excluded.watermark,
+                status='pending', owner=NULL, lease_expires=NULL, attempts=0, rows=NULL, error=NULL
+            WHERE tasks.status <> 'leased'
+            AND (? OR tasks.status <> 'done' OR tasks.candidacies <> excluded.candidacies
+                 OR tasks.watermark IS NOT excluded.watermark)
+        """
+
+
+class WorkQueue:
+    # (org, month, job) report tasks in a SQLite file opened by every worker process, on one machine or over
+    # shared storage (which must support file locking): pending -> leased to one worker, renewed by its
+    # heartbeat -> done, or back to pending on an error. A dead worker's lease expires and the task is claimed
+    # again; after max_attempts claims it is failed
+    def __init__(self, path, lease_seconds=QUEUE_LEASE_SECONDS, max_attempts=QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        db = sqlite3.connect(path, timeout=60)
+        try:
+            db.executescript(CREATE_QUEUE_SQL)
+        finally:
+            db.close()
+
+    @contextmanager
+    def transaction(self):
+        # a short connection per operation (workers are threads of several processes); BEGIN IMMEDIATE takes
+        # the write lock up front, so two workers never claim the same task
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def add(self, org, items, force=False):
+        # queues PlannedReports of org; returns the tasks added or requeued
+        rows = [(org, datetime.strftime(item.month_start, '%Y-%m'), item.job_id, item.job_name, item.candidacies,
+                 watermark_text(item.watermark), force) for item in items]
+        with self.transaction() as db:
+            changes = db.total_changes
+            db.executemany(UPSERT_TASK_SQL, rows)
+            return db.total_changes - changes
+
+    def claim(self, owner):
+        # (task id, org, PlannedReport) of the largest pending task, or of one whose lease expired, now leased
+        # to owner; None when there is none
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET status='failed', owner=NULL, lease_expires=NULL, error='lease expired' "
+                       "WHERE status='leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+            task = db.execute("SELECT id, org, month, job_id, job_name, candidacies, watermark FROM tasks "
+                              "WHERE status='pending' OR (status='leased' AND lease_expires < ?) "
+                              "ORDER BY candidacies DESC, id LIMIT 1", (now,)).fetchone()
+            if task is None:
+                return None
+            db.execute("UPDATE tasks SET status='leased', owner=?, lease_expires=?, attempts=attempts + 1 "
+                       "WHERE id=?", (owner, now + self.lease_seconds, task[0]))
+        task_id, org, month, job_id, job_name, candidacies, watermark = task
+        return task_id, org, PlannedReport(job_id, job_name, datetime.strptime(month, '%Y-%m'), candidacies,
+                                           datetime.fromisoformat(watermark) if watermark is not None else None)
+
+    def heartbeat(self, owner, task_ids):
+        with self.transaction() as db:
+            db.executemany("UPDATE tasks SET lease_expires=? WHERE id=? AND owner=? AND status='leased'",
+                           [(time.time() + self.lease_seconds, task_id, owner) for task_id in task_ids])
+
+    def complete(self, task_id, owner, rows):
+        # whether owner still held the lease; a no-op once it went to another worker, whose run then counts
+        with self.transaction() as db:
+            return db.execute("UPDATE tasks SET status='done', owner=NULL, lease_expires=NULL, rows=?, error=NULL, "
+                       "finished_at=? WHERE id=? AND owner=? AND status='leased'",
+                       (rows, datetime.now().isoformat(), task_id, owner)).rowcount == 1
+
+    def fail(self, task_id, owner, error):
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                       "owner=NULL, lease_expires=NULL, error=? WHERE id=? AND owner=? AND status='leased'",
+                       (self.max_attempts, error, task_id, owner))
+
+    def has_pending(self, org):
+        with self.transaction() as db:
+            return db.execute("SELECT EXISTS (SELECT 1 FROM tasks WHERE org=? AND status='pending')",
+                              (org,)).fetchone()[0] == 1
+
+    def counts(self):
+        # status -> tasks
+        with self.transaction() as db:
+            return dict(db.execute("SELECT status, count(*) FROM tasks GROUP BY status").fetchall())
+
+
+CREATE_QUERY_CACHE_SQL = """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                rows BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                used_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_lru ON results (used_at);
+            -- fields: running sum(size) of results, kept by QueryCache.put
+            CREATE TABLE IF NOT EXISTS meta (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total_size INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO meta (id, total_size) SELECT 0, coalesce(sum(size), 0) FROM results;
+        """
+
+# tables a statement reads (FROM / JOIN targets), whose fingerprints decide if its cached rows still hold
+SQL_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.I)
+
+# fingerprint of a table for the query cache: its row count and, when it has one, its latest updated_at
+SELECT_HAS_UPDATED_AT_SQL = """
+            SELECT EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attname = 'updated_at' AND NOT attisdropped
+            );
+        """
+
+
+def table_fingerprint_sql(table, has_updated_at):
+    return f"SELECT count(*), {'max(updated_at)' if has_updated_at else 'NULL'} FROM {table};"
+
+
+def query_cache_key(org_key, sql, params):
+    # the statement with its whitespace collapsed, its parameters and the org database
+    statement = " ".join(sql.split()).rstrip(";")
+    return hashlib.sha256(json.dumps([list(org_key), statement, params], default=str).encode()).hexdigest()
+
+
+class QueryCache:
+    # results of read-only statements in a SQLite file shared by runs and processes (--query-cache), each stored
+    # with the fingerprints of the tables it read and served while they are unchanged (see
+    # OrgContext.cached_rows). Rows are pickled and zlib-compressed; the total size is kept in the meta row, and
+    # past max_bytes the least recently used results are evicted. The file is in WAL mode, so hits are plain
+    # reads that never wait on a writer
+    def __init__(self, path, max_bytes=QUERY_CACHE_MB * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # fields: [(used_at, key)] of the hits not yet written (see flush)
+        self.touched = []
+        self._lock = threading.Lock()
+        db = sqlite3.connect(path, timeout=60)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(CREATE_QUERY_CACHE_SQL)
+        finally:
+            db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextmanager
+    def transaction(self):
+        # as WorkQueue.transaction: a short connection per operation
+        db = self.connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def get(self, key, fingerprint):
+        # the cached rows of key, or None when there are none or the tables changed since they were stored
+        db = self.connect()
+        try:
+            cached = db.execute("SELECT rows FROM results WHERE key=? AND fingerprint=?", (key, fingerprint)).fetchone()
+        finally:
+            db.close()
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.touched.append((time.time(), key))
+            touched = len(self.touched) >= QUERY_CACHE_TOUCH_BATCH
+        if touched:
+            self.flush()
+        return pickle.loads(zlib.decompress(cached[0]))
+
+    def flush(self):
+        # writes the used_at of the hits so far
+        with self._lock:
+            touched, self.touched = self.touched, []
+        if touched:
+            with self.transaction() as db:
+                db.executemany("UPDATE results SET used_at=? WHERE key=?", touched)
+
+    def put(self, key, fingerprint, rows):
+        blob = zlib.compress(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        if len(blob) > min(self.max_bytes, QUERY_CACHE_MAX_RESULT_KB * 2 ** 10):
+            return
+        with self.transaction() as db:
+            replaced = db.execute("SELECT size FROM results WHERE key=?", (key,)).fetchone()
+            db.execute("INSERT OR REPLACE INTO results (key, fingerprint, rows, size, used_at) VALUES (?, ?, ?, ?, ?)",
+                       (key, fingerprint, blob, len(blob), time.time()))
+            total_size = db.execute("UPDATE meta SET total_size = total_size + ? RETURNING total_size",
+                                    (len(blob) - (replaced[0] if replaced else 0),)).fetchone()[0]
+            if total_size <= self.max_bytes:
+                return
+            excess = total_size - int(self.max_bytes * QUERY_CACHE_EVICT_TO)
+            evicted = []
+            evicted_size = 0
+            for evicted_key, size in db.execute("SELECT key, size FROM results ORDER BY used_at"):
+                evicted.append((evicted_key,))
+                evicted_size += size
+                if evicted_size >= excess:
+                    break
+            db.executemany("DELETE FROM results WHERE key=?", evicted)
+            db.execute("UPDATE meta SET total_size = total_size - ?", (evicted_size,))
+
+    def stats_line(self):
+        self.flush()
+        return f"query cache {self.hits} hits, {self.misses} misses ({self.path})"
+
+
+def build_work_plan(rows, jobs):
+    # PlannedReports from SELECT_ACTIVITY_SQL rows, skipping jobs not in the job list
+    job_names = dict(jobs)
+    plan = [
+        PlannedReport(job_id, job_names[job_id], month_start, candidacies, watermark)
+        for job_id, month_start, candidacies, watermark in rows
+        if job_id in job_names
+    ]
+    plan.sort(key=lambda item: (-item.candidacies, item.month_start, item.job_id))
+    return plan
+
+
+SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER_RE = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+SQL_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+SQL_ARRAY_RE = re.compile(r"ARRAY\[[?,\s]*\]")
+SQL_COPY_RE = re.compile(r"^\s*COPY\s*\((.*)\)\s*TO\s+STDOUT", re.I | re.S)
+
+
+def normalize_sql(statement):
+    # query template of a statement: literals, id lists and arrays become ?, whitespace is collapsed, so
+    # the f-string built queries of every job and batch fall under one template
+    if isinstance(statement, bytes):
+        statement = statement.decode("utf-8", "replace")
+    # an EXECUTE counts under the statement it runs
+    statement = PREPARED_STATEMENTS.statement_for(statement) or statement
+    template = SQL_NUMBER_RE.sub("?", SQL_STRING_RE.sub("?", statement))
+    template = SQL_ARRAY_RE.sub("ARRAY[?]", SQL_LIST_RE.sub("(?)", template))
+    return " ".join(template.split()).rstrip(";").strip()
+
+
+def explain_sql(statement):
+    # EXPLAIN (ANALYZE, BUFFERS) of a SELECT, EXECUTE or the query of a COPY ... TO STDOUT; None for other statements
+    if isinstance(statement, bytes):
+        statement = statement.decode("utf-8", "replace")
+    copy = SQL_COPY_RE.match(statement)
+    query = copy.group(1) if copy else statement
+    if not query.lstrip().upper().startswith(("SELECT", "WITH", "EXECUTE")):
+        return None
+    return "EXPLAIN (ANALYZE, BUFFERS) " + query
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile of an ascending list
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class QueryProfile:
+    # statement timings of one org run (--profile), grouped by normalize_sql template: count, latency,
+    # rows returned and the time spent waiting for a pool connection before the statement ran
+    def __init__(self, org):
+        self.org = org
+        self.started_at = datetime.now()
+        # template -> [durations, rows, pool wait seconds, (seconds, statement, params) of the slowest run]
+        self.templates = {}
+        # template -> EXPLAIN (ANALYZE, BUFFERS) lines of its slowest statement
+        self.plans = {}
+        self.pool_waits = []
+        self._waited = threading.local()
+        self._lock = threading.Lock()
+
+    def cursor_factory(self, base=psycopg2.extensions.cursor):
+        return type("ProfilingCursor", (ProfilingCursor, base), {"profile": self})
+
+    def wait(self, seconds):
+        # pool wait of this thread, charged to the next statement it records
+        with self._lock:
+            self.pool_waits.append(seconds)
+        self._waited.seconds = getattr(self._waited, "seconds", 0.0) + seconds
+
+    def record(self, statement, seconds, rows, params=(), pool_wait=None):
+        if pool_wait is None:
+            pool_wait, self._waited.seconds = getattr(self._waited, "seconds", 0.0), 0.0
+        else:
+            with self._lock:
+                self.pool_waits.append(pool_wait)
+        template = normalize_sql(statement)
+        with self._lock:
+            stats = self.templates.setdefault(template, [[], 0, 0.0, None])
+            stats[0].append(seconds)
+            stats[1] += rows
+            stats[2] += pool_wait
+            if stats[3] is None or seconds > stats[3][0]:
+                stats[3] = (seconds, statement, params)
+
+    def explain_targets(self, limit):
+        # (template, EXPLAIN statement, params) of the slowest run of the `limit` templates with the most total time
+        targets = []
+        for template, stats in sorted(self.templates.items(), key=lambda item: -sum(item[1][0])):
+            if len(targets) >= limit:
+                break
+            _, statement, params = stats[3]
+            explain = explain_sql(statement)
+            if explain is not None:
+                targets.append((template, explain, params))
+        return targets
+
+    def summary(self):
+        total = sum(sum(stats[0]) for stats in self.templates.values())
+        templates = []
+        for template, (durations, rows, pool_wait, slowest) in self.templates.items():
+            durations = sorted(durations)
+            templates.append({
+                "template": template,
+                "count": len(durations),
+                "total_s": round(sum(durations), 4),
+                "share": round(sum(durations) / total, 4) if total else 0.0,
+                "p50_ms": round(percentile(durations, 0.5) * 1000, 2),
+                "p99_ms": round(percentile(durations, 0.99) * 1000, 2),
+                "max_ms": round(slowest[0] * 1000, 2),
+                "rows": rows,
+                "pool_wait_s": round(pool_wait, 4),
+                "plan": self.plans.get(template),
+            })
+        templates.sort(key=lambda stats: -stats["total_s"])
+        pool_waits = sorted(self.pool_waits)
+        return {
+            "org": self.org,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "statements": sum(stats["count"] for stats in templates),
+            "query_s": round(total, 4),
+            "pool_wait": {
+                "count": len(pool_waits),
+                "total_s": round(sum(pool_waits), 4),
+                "p50_ms": round(percentile(pool_waits, 0.5) * 1000, 2) if pool_waits else 0.0,
+                "p99_ms": round(percentile(pool_waits, 0.99) * 1000, 2) if pool_waits else 0.0,
+            },
+            "templates": templates,
+        }
+
+    def write(self, directory):
+        # query_profile-<org>.json and .txt in the org's report directory, replaced on every profiled run
+        summary = self.summary()
+        pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+        json_path = os.path.join(directory, f"query_profile-{self.org}.json")
+        with open(json_path, "w") as profile_file:
+            json.dump(summary, profile_file, indent=2)
+            profile_file.write("\n")
+
+        pool_wait = summary["pool_wait"]
+        lines = [
+            f"Query profile of {self.org}, {summary['started_at']} - {summary['finished_at']}",
+            f"{summary['statements']} statements in {len(summary['templates'])} templates, "
+            f"{summary['query_s']:.2f}s summed latency; pool wait {pool_wait['total_s']:.2f}s over "
+            f"{pool_wait['count']} checkouts (p50 {pool_wait['p50_ms']}ms, p99 {pool_wait['p99_ms']}ms)",
+            "",
+            f"{'#':>3} {'count':>7} {'total_s':>9} {'share':>6} {'p50_ms':>9} {'p99_ms':>9} {'rows':>9} "
+            f"{'wait_s':>8}  template",
+        ]
+        for idx, stats in enumerate(summary["templates"], 1):
+            template = stats["template"]
+            lines.append(f"{idx:>3} {stats['count']:>7} {stats['total_s']:>9.3f} {stats['share']:>6.1%} "
+                         f"{stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['rows']:>9} "
+                         f"{stats['pool_wait_s']:>8.3f}  {template[:120]}{'...' if len(template) > 120 else ''}")
+        for idx, stats in enumerate(summary["templates"], 1):
+            if stats["plan"]:
+                lines.extend(["", f"#{idx} {stats['template']}", *stats["plan"]])
+        text_path = os.path.join(directory, f"query_profile-{self.org}.txt")
+        with open(text_path, "w") as profile_file:
+            profile_file.write("\n".join(lines) + "\n")
+        return json_path, text_path
+
+
+class ProfilingCursor:
+    # mixed into the pool's cursor class by QueryProfile.cursor_factory: statements are timed into the
+    # profile as they execute; a named (server-side) cursor is timed over its fetches and recorded on close
+    profile = None
+    pending = None
+
+    def execute(self, query, vars=None):
+        started_at = time.perf_counter()
+        result = super().execute(query, vars)
+        if self.name is None:
+            self.profile.record(self.query, time.perf_counter() - started_at, max(self.rowcount, 0))
+        else:
+            # fields: [statement, seconds, rows]
+            self.pending = [self.mogrify(query, vars), time.perf_counter() - started_at, 0]
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        started_at = time.perf_counter()
+        result = super().copy_expert(sql, file, size)
+        self.profile.record(sql, time.perf_counter() - started_at, max(self.rowcount, 0))
+        return result
+
+    def fetchmany(self, size=None):
+        return self.timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self.timed_fetch(super().fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+    def timed_fetch(self, fetch, *args):
+        started_at = time.perf_counter()
+        rows = fetch(*args)
+        if self.pending is not None:
+            self.pending[1] += time.perf_counter() - started_at
+            self.pending[2] += len(rows)
+        return rows
+
+    def close(self):
+        if self.pending is not None:
+            self.profile.record(*self.pending)
+            self.pending = None
+        super().close()
+
+
+def read_org_config(context, org, config_path, pool_max):
+    # connection settings and pool bounds of a config.ini section, set on an Org(Async)Context
+    config = ConfigParser()
+    config.read(config_path)
+    context.org = org
+    context.DBNAME = config[org]["DBNAME"]
+    context.USER = config[org]["USER"]
+    context.PASSWORD = config[org]["PASSWORD"]
+    context.HOST = config[org]["HOST"]
+    context.PORT = config[org]["PORT"]
+    context.POOL_MAX = config[org].getint("POOL_MAX", DEFAULT_POOL_MAX)
+    if pool_max is not None:
+        # share of a global connection cap handed down by run_orgs, never below what one stream job holds
+        context.POOL_MAX = max(CONNECTIONS_PER_JOB, min(context.POOL_MAX, pool_max))
+    context.POOL_MIN = min(config[org].getint("POOL_MIN", DEFAULT_POOL_MIN), context.POOL_MAX)
+    context.QUERY_LIMIT_MIN = config[org].getint("QUERY_LIMIT_MIN", DEFAULT_QUERY_LIMIT_MIN)
+    context.QUERY_LIMIT_MAX = min(config[org].getint("QUERY_LIMIT_MAX", context.POOL_MAX), context.POOL_MAX)
+    context.LATENCY_TOLERANCE = config[org].getfloat("LATENCY_TOLERANCE", DEFAULT_LATENCY_TOLERANCE)
+    context.org_key = (context.HOST, context.PORT, context.DBNAME)
+    # a report job holds at most CONNECTIONS_PER_JOB connections at once (stream cursor + one query)
+    context.job_slots = max(1, context.POOL_MAX // CONNECTIONS_PER_JOB)
+
+
+class QueryLimit:
+    # AIMD limit on the queries of one org in flight at once, tuned from their latency (pool wait included).
+    # After each window of queries, a median latency above tolerance x the baseline (the lowest window median
+    # seen, drifting up 1% a window so a server that got slower for good is followed) cuts the limit by a
+    # quarter; otherwise it grows by one if the window ever had `limit` queries in flight. Kept in [floor, ceiling]
+    def __init__(self, initial, floor, ceiling, tolerance=DEFAULT_LATENCY_TOLERANCE):
+        self.floor = max(1, min(floor, ceiling))
+        self.ceiling = ceiling
+        self.limit = max(self.floor, min(initial, ceiling))
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baseline = None
+        self.window = []
+        self.saturated = False
+        # fields: [lowest, highest] limit so far
+        self.range = [self.limit, self.limit]
+        self.completed = 0
+        self.latency_total = 0.0
+        # completed queries and their latency at the previous log_line
+        self.logged = (time.perf_counter(), 0, 0.0)
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.acquired()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.released(time.perf_counter() - started_at)
+                self._cond.notify_all()
+
+    def acquired(self):
+        self.in_flight += 1
+        if self.in_flight >= self.limit:
+            self.saturated = True
+
+    def released(self, latency):
+        self.in_flight -= 1
+        self.completed += 1
+        self.latency_total += latency
+        self.window.append(latency)
+        if len(self.window) < max(self.limit, QUERY_LIMIT_WINDOW):
+            return
+        median = percentile(sorted(self.window), 0.5)
+        self.baseline = median if self.baseline is None else min(self.baseline * 1.01, median)
+        if median > self.tolerance * self.baseline:
+            self.limit = max(self.floor, self.limit * 3 // 4)
+        elif self.saturated:
+            self.limit = min(self.ceiling, self.limit + 1)
+        self.range = [min(self.range[0], self.limit), max(self.range[1], self.limit)]
+        self.window = []
+        self.saturated = False
+
+    def log_line(self):
+        # the current limit and the throughput since the previous call
+        now, completed, latency_total = time.perf_counter(), self.completed, self.latency_total
+        logged_at, logged_completed, logged_latency = self.logged
+        self.logged = (now, completed, latency_total)
+        queries = completed - logged_completed
+        mean_ms = (latency_total - logged_latency) / queries * 1000 if queries else 0.0
+        baseline_ms = f"{self.baseline * 1000:.1f} ms" if self.baseline is not None else "-"
+        return (f"query limit {self.limit} (ceiling {self.ceiling}, {self.range[0]}-{self.range[1]} so far), "
+                f"{self.in_flight} in flight, {queries / max(now - logged_at, 1e-9):.1f} queries/s, "
+                f"mean latency {mean_ms:.1f} ms (baseline median {baseline_ms})")
+
+
+class AsyncQueryLimit(QueryLimit):
+    # QueryLimit for the coroutines of one event loop
+    def __init__(self, initial, floor, ceiling, tolerance=DEFAULT_LATENCY_TOLERANCE):
+        super().__init__(initial, floor, ceiling, tolerance)
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.acquired()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.released(time.perf_counter() - started_at)
+                self._cond.notify_all()
+
+
+@contextmanager
+def logging_query_limit(org, query_limit, interval=QUERY_LIMIT_LOG_SECONDS):
+    # prints the org's query limit line every interval seconds while the block runs, and once at the end
+    stopped = threading.Event()
+
+    def log():
+        while not stopped.wait(interval):
+            print(f"{org}: {query_limit.log_line()}")
+
+    thread = threading.Thread(target=log, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+        print(f"{org}: {query_limit.log_line()}")
+
+
+class OrgContext:
+    # connection pool and job list of one config.ini section, shared by the JobCandidates of every date window
+    def __init__(self, org, config_path='./config.ini', pool_max=None, cursor_factory=None, profile=None,
+                 query_cache=None, lazy=False):
+        read_org_config(self, org, config_path, pool_max)
+        # QueryProfile of the run (--profile), timing every statement and pool checkout
+        self.profile = profile
+        # QueryCache of the run (--query-cache), and the fingerprints of the tables it was checked against,
+        # taken once per run (see cached_rows)
+        self.query_cache = query_cache
+        self.table_fingerprints = {}
+        self.fingerprint_lock = threading.Lock()
+        if profile is not None:
+            cursor_factory = profile.cursor_factory(cursor_factory or psycopg2.extensions.cursor)
+        # cursor_factory lets the benchmark count the queries of every pooled connection. A lazy pool opens no
+        # connection up front; psycopg2 closes returned connections beyond minconn, so it is raised afterwards
+        # to keep up to POOL_MIN of them for reuse either way
+        self.tcp = ThreadedConnectionPool(0 if lazy else self.POOL_MIN, self.POOL_MAX,
+                                          database=self.DBNAME,
+                                          user=self.USER,
+                                          password=self.PASSWORD,
+                                          host=self.HOST,
+                                          port=self.PORT,
+                                          cursor_factory=cursor_factory)
+        self.tcp.minconn = self.POOL_MIN
+        self.connection_slots = threading.BoundedSemaphore(self.POOL_MAX)
+        # queries in flight, held per statement (not per checkout, which a stream cursor keeps for the whole job)
+        self.query_limit = QueryLimit(self.POOL_MIN, self.QUERY_LIMIT_MIN, self.QUERY_LIMIT_MAX,
+                                      self.LATENCY_TOLERANCE)
+        # unlogged table of precomputed candidacy metrics while staged (see stage_candidacy_metrics)
+        self.staging_table = None
+
+        self.jobs = self.get_jobs()
+
+    def get_jobs(self):
+        return self.cached_rows(SELECT_JOBS_SQL, None, lambda: self.fetch_rows(SELECT_JOBS_SQL))
+
+    def fetch_rows(self, sql, params=None):
+        with self.query_limit.slot(), self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            conn.commit()
+            cur.close()
+        return rows
+
+    def cached_rows(self, sql, params, fetch):
+        # rows of a read-only statement: from the query cache while the tables it reads keep the fingerprints
+        # they had when it was stored, else from fetch() (then stored)
+        tables = sorted(set(SQL_TABLE_RE.findall(sql)))
+        if self.query_cache is None or not tables:
+            return fetch()
+        fingerprint = json.dumps([[table, *self.table_fingerprint(table)] for table in tables], default=str)
+        key = query_cache_key(self.org_key, sql, params)
+        rows = self.query_cache.get(key, fingerprint)
+        if rows is None:
+            rows = fetch()
+            self.query_cache.put(key, fingerprint, rows)
+        return rows
+
+    def table_fingerprint(self, table):
+        # (row count, latest updated_at) of a table, queried on its first use in the run
+        with self.fingerprint_lock:
+            if table not in self.table_fingerprints:
+                has_updated_at = self.fetch_rows(SELECT_HAS_UPDATED_AT_SQL, (table,))[0][0]
+                self.table_fingerprints[table] = self.fetch_rows(table_fingerprint_sql(table, has_updated_at))[0]
+            return self.table_fingerprints[table]
+
+    def get_work_plan(self, start_date, end_date):
+        # one grouped count for the whole org: only (job, month) pairs that have candidacies in
+        # [start_date, end_date) are planned, largest first. Never cached: its watermarks are what the
+        # manifest checks reports against
+        return build_work_plan(self.fetch_rows(SELECT_ACTIVITY_SQL, (start_date, end_date)), self.jobs)
+
+    def getconn(self):
+        # blocks while POOL_MAX connections are checked out, where the pool itself would raise PoolError
+        waited_at = time.perf_counter()
+        self.connection_slots.acquire()
+        try:
+            conn = self.tcp.getconn()
+        except BaseException:
+            self.connection_slots.release()
+            raise
+        if self.profile is not None:
+            self.profile.wait(time.perf_counter() - waited_at)
+        return conn
+
+    def putconn(self, conn):
+        try:
+            self.tcp.putconn(conn)
+        finally:
+            self.connection_slots.release()
+
+    @contextmanager
+    def connection(self):
+        # a checked out connection, rolled back if the block fails and always returned to the pool, so a
+        # failing job neither keeps its connection slot nor hands on an aborted transaction
+        conn = self.getconn()
+        try:
+            yield conn
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def stage_candidacy_metrics(self, start_date, end_date):
+        for stale in stale_staging_tables(self.fetch_rows(SELECT_STAGING_TABLES_SQL), time.time()):
+            print(f"Dropping stale staging table {stale}")
+            self.execute(f"DROP TABLE IF EXISTS {stale};")
+        table = staging_table_name()
+        self.execute(CREATE_STAGED_METRICS_SQL.format(table=table, start_date=start_date, end_date=end_date))
+        self.staging_table = table
+
+    def drop_staging(self):
+        if self.staging_table is not None:
+            self.execute(f"DROP TABLE IF EXISTS {self.staging_table};")
+            self.staging_table = None
+
+    def execute(self, sql):
+        conn = self.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute(sql)
+            cur.close()
+            conn.commit()
+        finally:
+            self.putconn(conn)
+
+    def explain(self, statement, params=None):
+        # plan lines of an EXPLAIN (ANALYZE, BUFFERS) statement, on an unprofiled cursor and rolled back
+        conn = self.getconn()
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            prepared = SQL_EXECUTE_RE.match(statement)
+            if prepared:
+                PREPARED_STATEMENTS.prepare(cur, prepared.group(1))
+            cur.execute(statement, params or None)
+            return [row[0] for row in cur.fetchall()]
+        finally:
+            conn.rollback()
+            self.putconn(conn)
+
+    def close(self):
+        if not self.tcp.closed:
+            try:
+                self.drop_staging()
+            finally:
+                self.tcp.closeall()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReportLayout:
+    # the assessment, scoring-dimension and custom-field columns of one report and its csv headers
+    def __init__(self,
+                 assessments,
+                 scoring_dimensions,
+                 non_pipeline_assessments,
+                 non_pipeline_scoring_dimensions,
+                 custom_fields,
+                 field_index=None):
+        self.assessments = assessments
+        self.scoring_dimensions = scoring_dimensions
+        self.non_pipeline_assessments = non_pipeline_assessments
+        self.non_pipeline_scoring_dimensions = non_pipeline_scoring_dimensions
+        self.custom_fields = custom_fields
+        self.all_assessments = assessments + non_pipeline_assessments
+        self.all_scoring_dimensions = scoring_dimensions + non_pipeline_scoring_dimensions
+        self.headers = self.build_headers()
+        self.columns = self.build_columns()
+        self.plan = ReportPlan(self, field_index or CANDIDACY_FIELD_INDEX)
+
+    def build_headers(self):
+        csv_headers = [
+            "user_id",
+            "user_last_name",
+            "user_first_name",
+            "user_email",
+            "user_country_code",
+            "user_phone",
+            "candidacy_id",
+            "candidacy_created_at",
+            "candidacy_pipeline_stage",
+            "candidacy_status",
+            "candidacy_failed",
+            "job_name",
+            "tags",
+            "percentile",
+            "weighted_percentage_score",
+            "assessments_remaining",
+            "assessments_completed",
+            "hours_since_application",
+            "email_messages_count",
+            "sms_messages_count",
+            "last_email_created_at",
+            "last_sms_created_at",
+            "calendar_events",
+        ]
+
+        for assessment in self.assessments:
+            # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
+            if len(assessment) <= 0:
+                continue
+            name = assessment[1].strip().lower().replace(" ", "_")
+            assessment_headers = [
+                f"{name}_percentage",
+                f"{name}_percentile",
+                f"{name}_score",
+                f"{name}_started_at",
+                f"{name}_completed_at",
+            ]
+            csv_headers.extend(assessment_headers)
+
+        for scoring_dimension in self.scoring_dimensions:
+            # fields: ['id', 'name', 'organization_id']
+            if len(scoring_dimension) <= 0:
+                continue
+            name = scoring_dimension[1].strip().lower().replace(" ", "_")
+            scoring_dimension_headers = [f"{name}_percentage", f"{name}_percentile"]
+            csv_headers.extend(scoring_dimension_headers)
+
+        for assessment in self.non_pipeline_assessments:
+            # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
+            if len(assessment) <= 0:
+                continue
+            name = assessment[1].strip().lower().replace(" ", "_") + "_non_pipline"
+            scoring_dimension_headers = [
+                f"{name}_percentage_NON_PIPELINE",
+                f"{name}_percentile_NON_PIPELINE",
+                f"{name}_score_NON_PIPELINE",
+                f"{name}_started_at_NON_PIPELINE",
+                f"{name}_completed_at_NON_PIPELINE",
+            ]
+            csv_headers.extend(scoring_dimension_headers)
+
+        for sd in self.non_pipeline_scoring_dimensions:
+            # fields: ['id', 'name', 'organization_id']
+            if len(sd) <= 0:
+                continue
+            name = sd[1].strip().lower().replace(" ", "_")
+            sd_headers = [f"{name}_percentage_NON_PIPELINE", f"{name}_percentile_NON_PIPELINE"]
+            csv_headers.extend(sd_headers)
+
+        for custom_field in self.custom_fields:
+            # fields: ['id', 'organization_id', 'name', 'slug', 'type']
+            if len(custom_field) <= 0:
+                continue
+            name = custom_field[2].strip()
+            csv_headers.append(name)
+        return csv_headers
+
+    def build_columns(self):
+        # (header, type) of every cell of a row, for the columnar sinks; the two cells a row has for an empty
+        # scoring dimension have no header (None) and are left out of columnar files
+        headers = iter(self.headers)
+        columns = [(next(headers), column_type) for column_type in LEADING_COLUMN_TYPES]
+        for assessments, scoring_dimensions in [(self.assessments, self.scoring_dimensions),
+                                                (self.non_pipeline_assessments, self.non_pipeline_scoring_dimensions)]:
+            for assessment in assessments:
+                if len(assessment) > 0:
+                    columns.extend((next(headers), column_type) for column_type in ASSESSMENT_COLUMN_TYPES)
+            for sd in scoring_dimensions:
+                if len(sd) > 0:
+                    columns.extend([(next(headers), "float"), (next(headers), "float")])
+                else:
+                    columns.extend([(None, "float"), (None, "float")])
+        columns.extend((header, "text") for header in headers)
+        return columns
+
+
+# types of the report columns user_id ... calendar_events, and of the five columns of each assessment
+LEADING_COLUMN_TYPES = [
+    "int", "text", "text", "text", "text", "text",
+    "int", "timestamp", "text", "text", "bool",
+    "text", "text",
+    "float", "float", "int", "int", "int",
+    "int", "int", "timestamp", "timestamp", "timestamp",
+]
+ASSESSMENT_COLUMN_TYPES = ["float", "float", "float", "timestamp", "timestamp"]
+
+
+# candidacy fields of the leading report columns (user_id ... candidacy_failed) and of
+# percentile ... assessments_remaining
+LEADING_CANDIDACY_FIELDS = [
+    "e_users.id",
+    "e_users.last_name",
+    "e_users.first_name",
+    "e_users.email",
+    "e_users.country_code",
+    "e_users.phone",
+    "e_candidacies.id",
+    "e_candidacies.created_at",
+    "e_pipeline_stages.name",
+    "e_candidacies.status",
+    "e_candidacies.failed",
+]
+SCORE_CANDIDACY_FIELDS = [
+    "e_candidacies.percentile",
+    "e_candidacies.weighted_percentage_score",
+    "e_candidacies.remaining_assessment_count",
+]
+# candidacy metrics of the columns after hours_since_application
+MESSAGE_METRIC_KEYS = [
+    "email_messages_count",
+    "sms_messages_count",
+    "last_email_created_at",
+    "last_sms_created_at",
+    "calendar_events",
+]
+EMPTY_ASSESSMENT_COLUMNS = ("", "", "", "", "")
+
+
+class ReportPlan:
+    # the row builder of one ReportLayout, compiled with its headers: itemgetter projections of the candidacy
+    # tuple and the assessment / scoring dimension ids of each column group, in column order, so a row is
+    # assembled without re-deriving the layout or looking fields up by name; field_index maps the candidacy
+    # fields to their positions in the candidacy rows
+    def __init__(self, layout, field_index):
+        self.leading_columns = operator.itemgetter(*[field_index[field] for field in LEADING_CANDIDACY_FIELDS])
+        self.score_columns = operator.itemgetter(*[field_index[field] for field in SCORE_CANDIDACY_FIELDS])
+        self.id_index = field_index["e_candidacies.id"]
+        self.user_id_index = field_index["e_candidacies.user_id"]
+        self.created_at_index = field_index["e_candidacies.created_at"]
+        self.percentile_index = field_index["e_candidacies.percentile"]
+        # fields: [assessment ids, scoring dimension ids (None for an empty one)] of the pipeline, then the
+        # non-pipeline columns
+        self.column_groups = [
+            ([assessment[0] for assessment in layout.assessments if assessment],
+             [sd[0] if sd else None for sd in layout.scoring_dimensions]),
+            ([assessment[0] for assessment in layout.non_pipeline_assessments],
+             [sd[0] if sd else None for sd in layout.non_pipeline_scoring_dimensions]),
+        ]
+        self.custom_field_ids = [custom_field[0] for custom_field in layout.custom_fields if custom_field]
+
+    def month(self, candidacy):
+        created_at = candidacy[self.created_at_index]
+        return created_at.year, created_at.month
+
+    def build_row(self, candidacy, jname, metrics, user_assessments, scoring_dimension_ratings, custom_field_answers):
+        candidacy_id = candidacy[self.id_index]
+        percentile = candidacy[self.percentile_index]
+        candidacy_metrics = metrics.get(candidacy_id, EMPTY_CANDIDACY_METRICS)
+
+        row = list(self.leading_columns(candidacy))
+        row.append(jname)
+        row.append(candidacy_metrics["tags"])
+        row.extend(self.score_columns(candidacy))
+        row.append(candidacy_metrics["assessments_completed"])
+        row.append(round((datetime.now() - candidacy[self.created_at_index]).total_seconds()))
+        for key in MESSAGE_METRIC_KEYS:
+            row.append(candidacy_metrics[key])
+
+        assessment_index, user_assessment_matrix = user_assessments
+        user_assessment_row = user_assessment_matrix.get(candidacy_id)
+        for assessment_ids, scoring_dimension_ids in self.column_groups:
+            for assessment_id in assessment_ids:
+                user_assessment = user_assessment_row[assessment_index[assessment_id]] if user_assessment_row else None
+                if user_assessment is None:
+                    row.extend(EMPTY_ASSESSMENT_COLUMNS)
+                else:
+                    percentage_score, score, started_at, completed_at = user_assessment
+                    row.extend((percentage_score, percentile, score, started_at, completed_at))
+            for scoring_dimension_id in scoring_dimension_ids:
+                if scoring_dimension_id is None:
+                    row.append("")
+                else:
+                    row.append(scoring_dimension_ratings.get((candidacy_id, scoring_dimension_id), ""))
+                row.append(percentile)
+
+        user_id = candidacy[self.user_id_index]
+        for custom_field_id in self.custom_field_ids:
+            row.append(custom_field_answers.get((user_id, custom_field_id), ""))
+        return row
+
+
+class CsvRowEnds(io.TextIOBase):
+    # psycopg2 hands COPY TO output over one row per write; rows end in "\r\n" like csv.writer rows
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, row):
+        self.file.write(row[:-1] + "\r\n")
+        return len(row)
+
+
+class CsvSink:
+    # the report as csv text (the default --format); COPY ... TO STDOUT WITH CSV output can be streamed into it
+    extension = ".csv"
+
+    def __init__(self, path, layout):
+        self.file = self.open(path)
+        self.csv_write = csv.writer(self.file)
+        self.csv_write.writerow(layout.headers)
+
+    def open(self, path):
+        return open(path, "w")
+
+    def write(self, row):
+        self.csv_write.writerow(row)
+
+    def copy(self, cur, copy_sql):
+        cur.copy_expert(copy_sql, CsvRowEnds(self.file))
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class GzipCsvSink(CsvSink):
+    extension = ".csv.gz"
+
+    def open(self, path):
+        # gzip's own default level; 9 costs several times the cpu for a few percent
+        return gzip.open(path, "wt", compresslevel=6)
+
+
+class ZstdCsvSink(CsvSink):
+    extension = ".csv.zst"
+
+    def open(self, path):
+        if zstandard is None:
+            raise RuntimeError("--format csv.zst requires the zstandard package")
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb")))
+
+
+# python conversion of the cells of each column type; "" and None are nulls
+COLUMN_CONVERTERS = {
+    "int": int,
+    "float": float,
+    "timestamp": None,
+    "bool": bool,
+    "text": str,
+}
+
+
+class ColumnarSink:
+    # the report as typed columns (ReportLayout.columns), buffered and written ROW_GROUP_ROWS rows at a time
+    def __init__(self, path, layout):
+        if pyarrow is None:
+            raise RuntimeError("--format parquet / arrow requires the pyarrow package")
+        arrow_types = {
+            "int": pyarrow.int64(),
+            "float": pyarrow.float64(),
+            "timestamp": pyarrow.timestamp("us"),
+            "bool": pyarrow.bool_(),
+            "text": pyarrow.string(),
+        }
+        # fields: [row position, converter]
+        self.cells = [(idx, COLUMN_CONVERTERS[column_type])
+                      for idx, (header, column_type) in enumerate(layout.columns) if header is not None]
+        self.schema = pyarrow.schema([(header, arrow_types[column_type])
+                                      for header, column_type in layout.columns if header is not None])
+        self.writer = self.open(path)
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= ROW_GROUP_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        arrays = []
+        for (idx, convert), field in zip(self.cells, self.schema):
+            values = [row[idx] for row in self.rows]
+            values = [None if value is None or value == "" else value if convert is None else convert(value)
+                      for value in values]
+            arrays.append(pyarrow.array(values, type=field.type))
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def abort(self):
+        self.writer.close()
+
+
+class ParquetSink(ColumnarSink):
+    # one row group per batch
+    extension = ".parquet"
+
+    def open(self, path):
+        return pyarrow.parquet.ParquetWriter(path, self.schema)
+
+
+class ArrowSink(ColumnarSink):
+    # Arrow IPC file format (random access, memory-mappable)
+    extension = ".arrow"
+
+    def open(self, path):
+        return pyarrow.ipc.new_file(path, self.schema)
+
+
+# --format choices
+REPORT_SINKS = {
+    "csv": CsvSink,
+    "csv.gz": GzipCsvSink,
+    "csv.zst": ZstdCsvSink,
+    "parquet": ParquetSink,
+    "arrow": ArrowSink,
+}
+
+
+class ReportFile:
+    # one report file, written by a sink (REPORT_SINKS); rows are built on a shared executor and written in
+    # submission order, keeping at most max_in_flight rows pending (None buffers the whole report until close)
+    def __init__(self, path, layout, executor, max_in_flight=None, sink=CsvSink, publish=None):
+        pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        # written under a temporary name of its own and renamed on close, so a crash never leaves a partial
+        # report and two runs of the same report (a reclaimed --queue lease) never write into one file
+        self.path = path
+        self.part_path = f"{path}.{uuid.uuid4().hex}.part"
+        self.sink = sink(self.part_path, layout)
+        # publish(rows), when given, decides on close whether the finished file replaces the report or is dropped
+        self.publish = publish
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.in_flight = deque()
+        self.rows = 0
+
+    def submit(self, fn, *args):
+        self.in_flight.append(self.executor.submit(fn, *args))
+        if self.max_in_flight is not None and len(self.in_flight) >= self.max_in_flight:
+            self.write(self.in_flight.popleft().result())
+
+    def write(self, row):
+        if row:
+            self.sink.write(row)
+            self.rows += 1
+
+    def copy(self, cur, copy_sql):
+        # COPY ... TO STDOUT WITH CSV output goes straight into the file after the header row
+        self.sink.copy(cur, copy_sql)
+        self.rows += cur.rowcount
+
+    def close(self):
+        if self.max_in_flight is None:
+            print ("WRITING FILE!")
+        while self.in_flight:
+            self.write(self.in_flight.popleft().result())
+        self.sink.close()
+        if self.publish is None or self.publish(self.rows):
+            os.replace(self.part_path, self.path)
+        else:
+            os.remove(self.part_path)
+
+    def abort(self):
+        for future in self.in_flight:
+            future.cancel()
+        self.in_flight.clear()
+        self.sink.abort()
+        os.remove(self.part_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class MonthlyReports:
+    # the per-month ReportFiles of one range-mode job, opened as the candidacies (sorted by created_at)
+    # move from one (year, month) key to the next; rows maps the key of every closed report to its row count
+    def __init__(self, path_for, executor, max_in_flight=None, sink=CsvSink):
+        self.path_for = path_for
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.sink = sink
+        self.report = None
+        self.month = None
+        self.rows = {}
+
+    def report_for(self, key, layout):
+        if key != self.month:
+            self.close()
+            self.report = ReportFile(self.path_for(key), layout, self.executor, self.max_in_flight, self.sink)
+            self.month = key
+        return self.report
+
+    def close(self):
+        if self.report is not None:
+            self.report.close()
+            self.rows[self.month] = self.report.rows
+            self.report = None
+
+    def abort(self):
+        if self.report is not None:
+            self.report.abort()
+            self.report = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
 
 
 class JobCandidates:
-    def __init__(self, start_date, end_date, org):
-        config = ConfigParser()
-        config.read('./config.ini')
-        self.DBNAME = config[org]["DBNAME"]
-        self.USER = config[org]["USER"]
-        self.PASSWORD = config[org]["PASSWORD"]
-        self.HOST = config[org]["HOST"]
-        self.PORT = config[org]["PORT"]
+    def __init__(self, start_date, end_date, org, context=None, stream=False, executor=None, copy=False,
+                 sink=CsvSink):
+        # without a shared context the instance opens (and owns) its own pool, as before
+        self.owns_context = context is None
+        self.context = OrgContext(org) if context is None else context
+        self.DBNAME = self.context.DBNAME
+        self.org_key = self.context.org_key
+        self.tcp = self.context.tcp
+        self.jobs = self.context.jobs
         self.start_date = start_date
         self.end_date = end_date
-        self.tcp = ThreadedConnectionPool(16, 80,
-                                       database=self.DBNAME,
-                                     user=self.USER,
-                                     password=self.PASSWORD,
-                                     host=self.HOST,
-                                     port=self.PORT)
-
-        self.jobs = self.get_jobs()
+        self.stream = stream
+        # row-building executor shared by concurrently scheduled jobs; None gives each report its own
+        self.executor = executor
+        # build whole reports in the database and COPY them into the files (see process_copy)
+        self.copy = copy
+        # output format of the reports (REPORT_SINKS)
+        self.sink = sink
+
+    def close(self):
+        if self.owns_context:
+            self.context.close()
+
+    @contextmanager
+    def row_executor(self):
+        if self.executor is not None:
+            yield self.executor
+        else:
+            with ThreadPoolExecutor(max_workers=cpu_count()) as exe:
+                yield exe
 
     def parameterize(self, string_to_clean, sep='-'):
         parameterized_string = unicodedata.normalize('NFKD', string_to_clean).encode('ASCII', 'ignore').decode()
@@ -86,171 +1985,214 @@ class JobCandidates:
 
         return parameterized_string.lower()
 
-    def connect_psql(self, sql):
+    def connect_psql(self, sql, params=None, cached=True):
+        # with --query-cache, served from the cache while the tables the statement reads are unchanged; the
+        # per-batch candidacy queries pass cached=False, only the org metadata and report lookups are kept
+        if cached:
+            return self.context.cached_rows(sql, params, lambda: self.connect_psql(sql, params, cached=False))
         # print("Opened database successfully")
-        conn = self.tcp.getconn()
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        # print(rows)
-        # print('fields:', [desc[0] for desc in cur.description])
-
-        conn.commit()
-        # print("Operation done successfully")
-        cur.close()
-        self.tcp.putconn(conn)
+        with self.context.query_limit.slot(), self.context.connection() as conn:
+            cur = conn.cursor()
+            if params is None:
+                cur.execute(sql)
+            else:
+                PREPARED_STATEMENTS.execute(cur, sql, params)
+            rows = cur.fetchall()
+            # print(rows)
+            # print('fields:', [desc[0] for desc in cur.description])
+
+            conn.commit()
+            # print("Operation done successfully")
+            cur.close()
         return rows
 
-    def get_candidacies(self, job_ids):
-        query = """
-            select
-                string_agg(format(
-                    '%%1$s.%%2$s as "%%1$s.%%2$s"',
-                    attrelid::regclass, attname
-                ) , ', ')
-            from pg_attribute
-            where attrelid = any (%s::regclass[]) and attnum > 0 and not attisdropped
-        """
-        conn = self.tcp.getconn()
-        cur = conn.cursor()
-        cur.execute(query, ([table for table in ("e_candidacies", "e_users", "e_pipeline_stages")],))
-        select_list = cur.fetchone()[0]
-
-        select_candidacies_sql = f"""
-                    SELECT {select_list} 
+    def candidacies_from_sql(self):
+        # the window's candidacies of a job list; placeholders filled by window_params
+        return """
                     FROM e_candidacies
                     INNER JOIN e_users ON e_candidacies.user_id=e_users.id 
                     INNER JOIN e_pipeline_stages 
                     ON e_pipeline_stages.job_id=e_candidacies.job_id AND e_candidacies.pipeline_stage_id=e_pipeline_stages.id
-                    WHERE e_candidacies.job_id IN {job_ids}
-                    AND e_candidacies.created_at >= '{self.start_date}'::date 
-                    AND e_candidacies.created_at < ('{self.end_date}'::date)
-                    ORDER BY e_candidacies.created_at;
+                    WHERE e_candidacies.job_id = ANY(%s)
+                    AND e_candidacies.created_at >= %s::date 
+                    AND e_candidacies.created_at < (%s::date)
                 """
 
-        cur.execute(select_candidacies_sql)
-        rows = cur.fetchall()
-        # print(rows)
-        # print("fields:", [desc[0] for desc in cur.description])
-
-        conn.commit()
-        cur.close()
-        self.tcp.putconn(conn)
-        return rows
+    def window_params(self, job_ids):
+        # the window bounds are '%Y-%m-%d' strings; bound as dates (asyncpg does not take text for a date)
+        start_date, end_date = [datetime.strptime(date, '%Y-%m-%d').date() if isinstance(date, str) else date
+                                for date in (self.start_date, self.end_date)]
+        return [list(job_ids), start_date, end_date]
 
-    def get_jobs(self):
-        conn = self.tcp.getconn()
-        cur = conn.cursor()
-        select_job_ids = """
-                    SELECT id, name 
-                    FROM e_jobs
-                    ORDER BY created_at
+    def candidacies_select_sql(self, select_list):
+        return f"""
+                    SELECT {select_list} 
+                    {self.candidacies_from_sql()}
+                    ORDER BY e_candidacies.created_at, e_candidacies.id;
                 """
 
-        cur.execute(select_job_ids)
-        rows = cur.fetchall()
-        conn.commit()
-        cur.close()
-        self.tcp.putconn(conn)
+    def get_candidacies(self, metadata, job_ids):
+        select_candidacies_sql = self.candidacies_select_sql(metadata.candidacy_select_list)
+        with self.context.query_limit.slot(), self.context.connection() as conn:
+            cur = conn.cursor()
+            PREPARED_STATEMENTS.execute(cur, select_candidacies_sql, self.window_params(job_ids))
+            rows = cur.fetchall()
+            metadata.read_candidacy_fields([desc[0] for desc in cur.description])
+            # print(rows)
+
+            conn.commit()
+            cur.close()
         return rows
 
-
-
-    def process(self, job_idx, jname, cur_path, year, month):
-        job_ids = f"({job_idx})"
-        # print("==================process==================")
-
-        scoring_dimension_ids = []
-
-        select_organization_sql = f"SELECT DISTINCT organization_id FROM e_jobs WHERE id IN {job_ids};"
-        organizations = self.connect_psql(select_organization_sql)
-        # print("organizations: ", organizations)
-
-        org_id = organizations[0][0] if len(organizations) > 0 else "NULL"
-        # print("org_id: ", org_id)
-
-        select_custom_field_sql = f"SELECT DISTINCT * FROM e_custom_fields WHERE organization_id={org_id};"
-        custom_fields = self.connect_psql(select_custom_field_sql)
-        # print("custom_fields length: ", len(custom_fields))
-
-        sql = """
-            SELECT a.* 
-            FROM e_assessments as a 
-            INNER JOIN e_job_assessments as ja ON ja.assessment_id = a.id 
-            WHERE ja.job_id IN {} order by ja.sequence;
-        """.format(
-            job_ids
+    def iter_candidacies(self, metadata, job_ids, chunk_size=CURSOR_ITERSIZE):
+        # same rows as get_candidacies, read through a server-side cursor chunk_size rows at a time;
+        # the connection stays checked out until the generator is exhausted or closed; each round trip takes
+        # a query slot of its own
+        with self.context.connection() as conn:
+            # DECLARE cannot run a prepared statement: the server-side cursor binds its parameters instead
+            cur = conn.cursor(name="candidacies")
+            cur.itersize = chunk_size
+            with self.context.query_limit.slot():
+                cur.execute(self.candidacies_select_sql(metadata.candidacy_select_list), self.window_params(job_ids))
+            while True:
+                with self.context.query_limit.slot():
+                    rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                # a named cursor has its description once the first rows are fetched
+                metadata.read_candidacy_fields([desc[0] for desc in cur.description])
+                yield rows
+            cur.close()
+            conn.commit()
+
+    def get_user_assessment_matrix(self, candidate_ids, assessment_ids):
+        # one query per job: candidacy_id -> row with one (percentage_score, score, started_at, completed_at)
+        # slot per assessment, positioned by assessment_index; None where the user has no user assessment
+        assessment_index = {assessment_id: idx for idx, assessment_id in enumerate(dict.fromkeys(assessment_ids))}
+        if not candidate_ids or not assessment_index:
+            return assessment_index, {}
+
+        rows = self.connect_psql(SELECT_USER_ASSESSMENTS_SQL, (list(candidate_ids), list(assessment_index)),
+                                 cached=False)
+        return assessment_index, build_user_assessment_matrix(assessment_index, rows)
+
+    def resolve_scoring_dimension_ids(self, metadata, assessment_ids):
+        # assessment_id -> scoring rule ids through e_steps, memoized on the org metadata for the whole run;
+        # only assessments not seen before hit the database, in a single join
+        cache = metadata.scoring_dimension_ids
+        missing = [assessment_id for assessment_id in set(assessment_ids) if assessment_id not in cache]
+        if missing:
+            store_scoring_rule_ids(cache, missing, self.connect_psql(SELECT_SCORING_RULES_SQL, (missing,)))
+        return {assessment_id: cache[assessment_id] for assessment_id in assessment_ids}
+
+    def get_scoring_dimension_ratings(self, candidate_ids, scoring_dimension_ids):
+        # sparse (candidacy_id, scoring_dimension_id) -> percentage_score index, streamed through a
+        # server-side cursor; pairs without a rating are simply absent
+        ratings = {}
+        if not candidate_ids or not scoring_dimension_ids:
+            return ratings
+
+        with self.context.query_limit.slot(), self.context.connection() as conn:
+            cur = conn.cursor(name="scoring_dimension_ratings")
+            cur.itersize = CURSOR_ITERSIZE
+            cur.execute(SELECT_SCORING_DIMENSION_RATINGS_SQL,
+                        (list(candidate_ids), list(set(scoring_dimension_ids))))
+            for candidacy_id, scoring_dimension_id, percentage_score in cur:
+                ratings[(candidacy_id, scoring_dimension_id)] = percentage_score
+            cur.close()
+            conn.commit()
+        return ratings
+
+    def get_custom_field_answers(self, user_ids, custom_field_ids):
+        # one query per batch for every custom field column of the job, through the org's cached
+        # question -> custom field mapping
+        metadata = ORG_METADATA_CACHE.get(self.org_key, self.connect_psql)
+        question_ids = metadata.get_question_ids(custom_field_ids)
+        if not user_ids or not question_ids:
+            return {}
+        rows = self.connect_psql(SELECT_CUSTOM_FIELD_ANSWERS_SQL, (list(user_ids), question_ids), cached=False)
+        return build_custom_field_answers(metadata.custom_field_ids_by_question, rows)
+
+    def get_candidacy_metrics(self, candidate_ids):
+        # one grouped query per source table for every candidacy of the job instead of
+        # ~8 point lookups per candidacy; missing candidacies fall back to EMPTY_CANDIDACY_METRICS
+        candidate_ids = list(candidate_ids)
+        if not candidate_ids:
+            return build_candidacy_metrics(candidate_ids, [], [], [], [])
+        if self.context.staging_table is not None:
+            select_staged_sql = SELECT_STAGED_METRICS_SQL.format(table=self.context.staging_table)
+            # the staging table is new every run, so its rows are never cached
+            return build_staged_candidacy_metrics(candidate_ids,
+                                                  self.connect_psql(select_staged_sql, (candidate_ids,), cached=False))
+        return build_candidacy_metrics(
+            candidate_ids,
+            *[self.connect_psql(sql, (candidate_ids,), cached=False) for sql in CANDIDACY_METRICS_QUERIES]
         )
-        ordered_but_potentially_duplicated_assessments = self.connect_psql(sql)
-        # print(
-        #     "ordered_but_potentially_duplicated_assessments length: ",
-        #     len(ordered_but_potentially_duplicated_assessments),
-        # )
 
-        assessment_ids_set = set()
-        for value in ordered_but_potentially_duplicated_assessments:
-            assessment_ids_set.add(value[0])
-        assessment_ids = tuple(assessment_ids_set)
+    def report_path(self, cur_path, job_idx, jname, year, month):
+        return os.path.join(cur_path, 'reports', self.DBNAME, f"{month}-{year}",
+                            f"{job_idx}-{self.parameterize(jname)}{self.sink.extension}")
+
+    def get_job_assessments(self, metadata, job_idx):
+        # pipeline assessments of the job, plus their ids for the non-pipeline query
+        assessment_ids = list(metadata.job_assessment_ids.get(job_idx, ()))
 
         if len(assessment_ids) > 0:
-            if len(assessment_ids) == 1:
-                assessment_ids = f"({assessment_ids[0]})"
-            select_assessments_sql = f"SELECT DISTINCT * from e_assessments WHERE id IN {assessment_ids};"
-            assessments = self.connect_psql(select_assessments_sql)
+            assessments = metadata.get_assessments(assessment_ids)
         else:
             assessments = [()]
         # print("assessments length: ", len(assessments))
+        return assessments, assessment_ids
+
+    def non_pipeline_assessments_sql(self, by_month=False):
+        # assessments taken by the window's candidates outside the job pipeline; restricted to the same
+        # candidacies get_candidacies returns, without shipping their ids back (see non_pipeline_assessments_params)
+        window_candidacy_ids_sql = f"SELECT e_candidacies.id {self.candidacies_from_sql()}"
+        month_column = "date_trunc('month', c.created_at), " if by_month else ""
+        return f"""
+            SELECT DISTINCT {month_column}a.* FROM e_user_assessments as ua
+            INNER JOIN e_candidacies as c ON ua.user_id=c.user_id
+            INNER JOIN e_assessments as a ON a.id=ua.assessment_id
+            WHERE c.job_id = ANY(%s) AND c.id IN ({window_candidacy_ids_sql})
+            AND a.id <> ALL(%s)
+            ORDER BY {'1, ' if by_month else ''}a.id;
+        """
 
-        candidacies = self.get_candidacies(job_ids)
-        # print("candidacies length: ", len(candidacies))
+    def non_pipeline_assessments_params(self, job_ids, assessment_ids):
+        # no pipeline assessments: <> ALL of an empty array keeps every assessment
+        return [list(job_ids), *self.window_params(job_ids), list(assessment_ids)]
 
-        candidate_ids_set = set()
-        if len(candidacies) > 0:
-            for value in candidacies:
-                # fields: ['id', 'user_id', 'job_id', 'pipeline_stage_id', 'added_to_stage_at', 'score', 'possible_score', 'weighted_percentage_score', 'archive_reason', 'parent_candidacy_id', 'status', 'progress', 'failed', 'withdraw_reason', 'percentile', 'completed_user_assessments', 'scoring_completed', 'external_job_id', 'remaining_assessment_count', 'created_at', 'updated_at', 'id', 'email', 'first_name', 'middle_name', 'last_name', 'country_code', 'phone', 'created_at', 'updated_at', 'id', 'name', 'sequence', 'slug', 'job_id', 'maintain_anonymity', 'type', 'created_at', 'updated_at']
-                candidate_ids_set.add(value[0])
-        else:
-            return
-        candidate_ids = tuple(candidate_ids_set)
+    def get_job_columns(self, metadata, job_idx):
+        # custom fields of the job's org and its pipeline assessments (see get_job_assessments)
+        org_id = metadata.organization_ids.get(job_idx)
+        # print("org_id: ", org_id)
+
+        custom_fields = metadata.custom_fields.get(org_id, []) if org_id is not None else []
+        # print("custom_fields length: ", len(custom_fields))
 
+        assessments, assessment_ids = self.get_job_assessments(metadata, job_idx)
+        return custom_fields, assessments, assessment_ids
+
+    def build_layout(self,
+                     metadata,
+                     assessments,
+                     non_pipeline_assessments,
+                     custom_fields,
+                     scoring_dimension_ids_by_assessment=None):
+        scoring_dimension_ids = []
         non_pipeline_scoring_dimension_ids = []
 
-        if len(candidate_ids) > 0:
-            str_candidate_ids = str(candidate_ids)
-            if len(candidate_ids) == 1:
-                str_candidate_ids = str(candidate_ids).replace(',', '') # deal with solo item
-            sql = ''
-            if len(assessment_ids) > 0:
-                sql = f"""
-                    SELECT DISTINCT a.* FROM e_user_assessments as ua
-                    INNER JOIN e_candidacies as c ON ua.user_id=c.user_id
-                    INNER JOIN e_assessments as a ON a.id=ua.assessment_id
-                    WHERE c.job_id IN {job_ids} AND c.id IN {str_candidate_ids} 
-                    AND a.id NOT IN {assessment_ids}
-                """
-            else:
-                sql = f"""
-                    SELECT DISTINCT a.* FROM e_user_assessments as ua
-                    INNER JOIN e_candidacies as c ON ua.user_id=c.user_id
-                    INNER JOIN e_assessments as a ON a.id=ua.assessment_id
-                    WHERE c.job_id IN {job_ids} AND c.id IN {str_candidate_ids}
-                """
-            non_pipeline_assessments = self.connect_psql(sql)
-        else:
-            non_pipeline_assessments = [()]
-        # print("non_pipeline_assessments length: ", len(non_pipeline_assessments))
+        if scoring_dimension_ids_by_assessment is None:
+            scoring_dimension_ids_by_assessment = self.resolve_scoring_dimension_ids(
+                metadata,
+                [assessment[0] for assessment in assessments + non_pipeline_assessments if assessment]
+            )
 
         for assessment in assessments:
             # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
             if len(assessment) <= 0:
                 continue
-            select_steps_sql = f"SELECT id FROM e_steps WHERE assessment_id={assessment[0]};"
-            steps = self.connect_psql(select_steps_sql)
-            for step in steps:
-                select_scoring_rules_sql = f"SELECT id FROM e_scoring_rules WHERE step_id={step[0]}"
-                scoring_rules = self.connect_psql(select_scoring_rules_sql)
-                for sr in scoring_rules:
-                    scoring_dimension_ids.append(sr[0])
+            scoring_dimension_ids.extend(scoring_dimension_ids_by_assessment[assessment[0]])
 
         scoring_dimension_ids = tuple(set(scoring_dimension_ids))
         # print("scoring_dimension_ids length:", len(scoring_dimension_ids))
@@ -259,407 +2201,1238 @@ class JobCandidates:
             # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
             if len(assessment) <= 0:
                 continue
-            select_steps_sql = f"SELECT id FROM e_steps WHERE assessment_id={assessment[0]};"
-            steps = self.connect_psql(select_steps_sql)
-            for step in steps:
-                select_scoring_rules_sql = f"SELECT id FROM e_scoring_rules WHERE step_id={step[0]}"
-                scoring_rules = self.connect_psql(select_scoring_rules_sql)
-                for sr in scoring_rules:
-                    non_pipeline_scoring_dimension_ids.append(sr[0])
+            non_pipeline_scoring_dimension_ids.extend(scoring_dimension_ids_by_assessment[assessment[0]])
 
         non_pipeline_scoring_dimension_ids = tuple(set(non_pipeline_scoring_dimension_ids))
         # print("non_pipeline_scoring_dimension_ids length:", len(non_pipeline_scoring_dimension_ids))
 
         if len(scoring_dimension_ids) > 0:
-            if len(scoring_dimension_ids) == 1:
-                scoring_dimension_ids = f"({scoring_dimension_ids[0]})"
-            select_scoring_dimensions_sql = (
-                f"SELECT DISTINCT * FROM e_scoring_dimensions WHERE id IN {scoring_dimension_ids};"
-            )
-            scoring_dimensions = self.connect_psql(select_scoring_dimensions_sql)
+            scoring_dimensions = metadata.get_scoring_dimensions(scoring_dimension_ids)
         else:
             scoring_dimensions = [()]
         # print("scoring_dimensions length: ", len(scoring_dimensions))
 
         if len(non_pipeline_scoring_dimension_ids) > 0:
-            if len(non_pipeline_scoring_dimension_ids) == 1:
-                non_pipeline_scoring_dimension_ids = f"({non_pipeline_scoring_dimension_ids[0]})"
-            select_non_pipeline_scoring_dimensions_sql = (
-                f"SELECT DISTINCT * FROM e_scoring_dimensions WHERE id IN {non_pipeline_scoring_dimension_ids};"
-            )
-            non_pipeline_scoring_dimensions = self.connect_psql(select_non_pipeline_scoring_dimensions_sql)
+            non_pipeline_scoring_dimensions = metadata.get_scoring_dimensions(non_pipeline_scoring_dimension_ids)
         else:
             non_pipeline_scoring_dimensions = [()]
         # print("non_pipeline_scoring_dimensions length: ", len(non_pipeline_scoring_dimensions))
 
-        path = os.path.join(cur_path, 'reports', self.DBNAME, f"{month}-{year}",  f"{job_idx}-{self.parameterize(jname)}.csv")
-        pathlib.Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
-        with open(path, "w") as file:
-            csv_write = csv.writer(file)
-            csv_headers = [
-                "user_id",
-                "user_last_name",
-                "user_first_name",
-                "user_email",
-                "user_country_code",
-                "user_phone",
-                "candidacy_id",
-                "candidacy_created_at",
-                "candidacy_pipeline_stage",
-                "candidacy_status",
-                "candidacy_failed",
-                "job_name",
-                "tags",
-                "percentile",
-                "weighted_percentage_score",
-                "assessments_remaining",
-                "assessments_completed",
-                "hours_since_application",
-                "email_messages_count",
-                "sms_messages_count",
-                "last_email_created_at",
-                "last_sms_created_at",
-                "calendar_events",
-            ]
-
-            for assessment in assessments:
-                # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
-                if len(assessment) <= 0:
-                    continue
-                name = assessment[1].strip().lower().replace(" ", "_")
-                assessment_headers = [
-                    f"{name}_percentage",
-                    f"{name}_percentile",
-                    f"{name}_score",
-                    f"{name}_started_at",
-                    f"{name}_completed_at",
-                ]
-                csv_headers.extend(assessment_headers)
-
-            for scoring_dimension in scoring_dimensions:
-                # fields: ['id', 'name', 'organization_id']
-                if len(scoring_dimension) <= 0:
-                    continue
-                name = scoring_dimension[1].strip().lower().replace(" ", "_")
-                scoring_dimension_headers = [f"{name}_percentage", f"{name}_percentile"]
-                csv_headers.extend(scoring_dimension_headers)
+        return ReportLayout(assessments,
+                            scoring_dimensions,
+                            non_pipeline_assessments,
+                            non_pipeline_scoring_dimensions,
+                            custom_fields,
+                            metadata.candidacy_field_index)
+
+    def process(self, job_idx, jname, cur_path, year, month, publish=None):
+        if self.copy:
+            return self.process_copy(job_idx, jname, cur_path, year, month, publish)
+        job_ids = [job_idx]
+        # print("==================process==================")
 
-            for assessment in non_pipeline_assessments:
-                # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
-                if len(assessment) <= 0:
-                    continue
-                name = assessment[1].strip().lower().replace(" ", "_") + "_non_pipline"
-                scoring_dimension_headers = [
-                    f"{name}_percentage_NON_PIPELINE",
-                    f"{name}_percentile_NON_PIPELINE",
-                    f"{name}_score_NON_PIPELINE",
-                    f"{name}_started_at_NON_PIPELINE",
-                    f"{name}_completed_at_NON_PIPELINE",
-                ]
-                csv_headers.extend(scoring_dimension_headers)
-
-            for sd in non_pipeline_scoring_dimensions:
-                # fields: ['id', 'name', 'organization_id']
-                if len(sd) <= 0:
-                    continue
-                name = sd[1].strip().lower().replace(" ", "_")
-                sd_headers = [f"{name}_percentage_NON_PIPELINE", f"{name}_percentile_NON_PIPELINE"]
-                csv_headers.extend(sd_headers)
+        metadata = ORG_METADATA_CACHE.get(self.org_key, self.connect_psql)
+        custom_fields, assessments, assessment_ids = self.get_job_columns(metadata, job_idx)
 
-            for custom_field in custom_fields:
-                # fields: ['id', 'organization_id', 'name', 'slug', 'type']
-                if len(custom_field) <= 0:
+        if self.stream:
+            chunks = self.iter_candidacies(metadata, job_ids)
+        else:
+            chunks = iter([self.get_candidacies(metadata, job_ids)])
+        # the stream is closed however the report ends, so a failing job does not keep its cursor and connection
+        # checked out until the generator is garbage collected
+        try:
+            first_chunk = next(chunks, None)
+            # print("candidacies length: ", len(first_chunk))
+            if not first_chunk:
+                return None
+
+            non_pipeline_assessments = self.connect_psql(self.non_pipeline_assessments_sql(),
+                                                         self.non_pipeline_assessments_params(job_ids, assessment_ids))
+            # print("non_pipeline_assessments length: ", len(non_pipeline_assessments))
+
+            layout = self.build_layout(metadata, assessments, non_pipeline_assessments, custom_fields)
+
+            path = self.report_path(cur_path, job_idx, jname, year, month)
+            with self.row_executor() as exe:
+                with ReportFile(path, layout, exe, ROW_WINDOW if self.stream else None, self.sink,
+                                publish) as report:
+                    for candidacies in itertools.chain([first_chunk], chunks):
+                        lookups = self.load_row_lookups(candidacies, layout.plan, layout.all_assessments,
+                                                        layout.all_scoring_dimensions, layout.custom_fields)
+                        for candidacy in candidacies:
+                            report.submit(self.create_candidacy_record, candidacy, jname, layout, *lookups)
+            return report.rows
+        finally:
+            if self.stream:
+                chunks.close()
+
+    def process_copy(self, job_idx, jname, cur_path, year, month, publish=None):
+        # copy mode: the report rows are assembled by a single statement (report_copy_sql) and streamed
+        # into the file by COPY, without passing through Python objects
+        job_ids = [job_idx]
+        metadata = ORG_METADATA_CACHE.get(self.org_key, self.connect_psql)
+        custom_fields, assessments, assessment_ids = self.get_job_columns(metadata, job_idx)
+
+        if not self.connect_psql(f"SELECT EXISTS (SELECT 1 {self.candidacies_from_sql()});",
+                                 self.window_params(job_ids), cached=False)[0][0]:
+            return None
+
+        non_pipeline_assessments = self.connect_psql(self.non_pipeline_assessments_sql(),
+                                                     self.non_pipeline_assessments_params(job_ids, assessment_ids))
+        layout = self.build_layout(metadata, assessments, non_pipeline_assessments, custom_fields)
+
+        path = self.report_path(cur_path, job_idx, jname, year, month)
+        with ReportFile(path, layout, None, sink=self.sink, publish=publish) as report, \
+                self.context.query_limit.slot(), self.context.connection() as conn:
+            cur = conn.cursor()
+            copy_sql = cur.mogrify(self.report_copy_sql(layout), [jname, *self.window_params(job_ids)])
+            report.copy(cur, copy_sql)
+            cur.close()
+            conn.commit()
+        return report.rows
+
+    def report_copy_sql(self, layout):
+        # COPY statement producing the create_candidacy_record rows of the window, in the same order;
+        # one lateral join per metric source (or the staged metrics), assessment and scoring dimension column
+        if self.context.staging_table is not None:
+            metric_columns = {key: f"staged.{key}" for key in STAGED_METRIC_KEYS}
+            for key in ("assessments_completed", "email_messages_count", "sms_messages_count"):
+                metric_columns[key] = f"coalesce(staged.{key}, 0)"
+            joins = [f"LEFT JOIN {self.context.staging_table} AS staged ON staged.candidacy_id=e_candidacies.id"]
+        else:
+            metric_columns, joins = self.copy_metric_joins()
+
+        columns = [
+            "e_users.id",
+            "e_users.last_name",
+            "e_users.first_name",
+            "e_users.email",
+            "e_users.country_code",
+            "e_users.phone",
+            "e_candidacies.id",
+            "e_candidacies.created_at",
+            "e_pipeline_stages.name",
+            "e_candidacies.status",
+            "e_candidacies.failed",
+            "job.name",
+            metric_columns["tags"],
+            "e_candidacies.percentile",
+            "e_candidacies.weighted_percentage_score",
+            "e_candidacies.remaining_assessment_count",
+            metric_columns["assessments_completed"],
+            "round(extract(epoch FROM localtimestamp - e_candidacies.created_at))::bigint",
+            metric_columns["email_messages_count"],
+            metric_columns["sms_messages_count"],
+            metric_columns["last_email_created_at"],
+            metric_columns["last_sms_created_at"],
+            metric_columns["calendar_events"],
+        ]
+
+        assessment_aliases = {}
+        for assessment in layout.all_assessments:
+            if not assessment or assessment[0] in assessment_aliases:
+                continue
+            alias = assessment_aliases[assessment[0]] = f"ua_{len(assessment_aliases)}"
+            joins.append(f"""LEFT JOIN LATERAL (
+                SELECT true AS found, ua.percentage_score, ua.started_at, ua.completed_at FROM e_user_assessments AS ua
+                WHERE ua.user_id=e_candidacies.user_id AND ua.assessment_id={int(assessment[0])}
+                ORDER BY ua.id LIMIT 1
+            ) AS {alias} ON true""")
+
+        scoring_dimension_aliases = {}
+        for sd in layout.all_scoring_dimensions:
+            if not sd or sd[0] in scoring_dimension_aliases:
+                continue
+            alias = scoring_dimension_aliases[sd[0]] = f"sdr_{len(scoring_dimension_aliases)}"
+            joins.append(f"""LEFT JOIN LATERAL (
+                SELECT percentage_score FROM e_scoring_dimension_ratings
+                WHERE candidacy_id=e_candidacies.id AND scoring_dimension_id={int(sd[0])}
+                ORDER BY id LIMIT 1
+            ) AS {alias} ON true""")
+
+        for assessments, scoring_dimensions in [
+            (layout.assessments, layout.scoring_dimensions),
+            (layout.non_pipeline_assessments, layout.non_pipeline_scoring_dimensions),
+        ]:
+            for assessment in assessments:
+                if not assessment:
                     continue
-                name = custom_field[2].strip()
-                csv_headers.append(name)
-
-            # print("headers length: ", len(csv_headers))
-            csv_write.writerow(csv_headers)
-            with ThreadPoolExecutor(max_workers=cpu_count()) as exe:
-                results = [exe.submit(self.create_candidacy_record,
-                                      candidacy,
-                                      jname,
-                                      assessments,
-                                      scoring_dimensions,
-                                      non_pipeline_assessments,
-                                      non_pipeline_scoring_dimensions,
-                                      custom_fields
-                                      ) for candidacy in candidacies]
-                data = []
-                for future in results:
-                    data.append(future.result())
-            print ("WRITING FILE!")
-            for d in data:
-                if d:
-                    csv_write.writerow(d)
+                alias = assessment_aliases[assessment[0]]
+                columns.extend([
+                    f"{alias}.percentage_score",
+                    f"CASE WHEN {alias}.found THEN e_candidacies.percentile END",
+                    f"CASE WHEN {alias}.found THEN e_candidacies.score END",
+                    f"{alias}.started_at",
+                    f"{alias}.completed_at",
+                ])
+            for sd in scoring_dimensions:
+                columns.extend([
+                    f"{scoring_dimension_aliases[sd[0]]}.percentage_score" if sd else "NULL",
+                    "e_candidacies.percentile",
+                ])
+
+        # the user's latest non-empty answer to the custom field, as in build_custom_field_answers
+        for idx, custom_field in enumerate(custom_field for custom_field in layout.custom_fields if custom_field):
+            columns.append(f"custom_field_{idx}.value")
+            joins.append(f"""LEFT JOIN LATERAL (
+                SELECT value FROM e_answers
+                WHERE user_id=e_candidacies.user_id
+                AND question_id IN (SELECT id FROM e_questions WHERE custom_field_id={int(custom_field[0])})
+                AND value<>''
+                ORDER BY id DESC LIMIT 1
+            ) AS custom_field_{idx} ON true""")
+
+        join_sql = "\n                ".join(joins)
+        select_sql = ",\n                    ".join(csv_value_sql(column) for column in columns)
+        return f"""
+            COPY (
+                SELECT
+                    {select_sql}
+                FROM e_candidacies
+                INNER JOIN e_users ON e_candidacies.user_id=e_users.id
+                INNER JOIN e_pipeline_stages
+                ON e_pipeline_stages.job_id=e_candidacies.job_id AND e_candidacies.pipeline_stage_id=e_pipeline_stages.id
+                CROSS JOIN (SELECT %s::text AS name) AS job
+                {join_sql}
+                WHERE e_candidacies.job_id = ANY(%s)
+                AND e_candidacies.created_at >= %s::date
+                AND e_candidacies.created_at < (%s::date)
+                ORDER BY e_candidacies.created_at, e_candidacies.id
+            ) TO STDOUT WITH CSV
+        """
 
-                # print("values length: ", len(csv_values))
-                # print("csv_values: ", csv_values)
-                # print("=" * 40)
+    def copy_metric_joins(self):
+        # report_copy_sql metric columns looked up per candidacy, when they are not staged
+        joins = [
+            """LEFT JOIN LATERAL (
+                SELECT t.name FROM e_tags AS t
+                INNER JOIN e_candidacy_tags AS ct ON ct.tag_id=t.id
+                WHERE ct.candidacy_id=e_candidacies.id
+                ORDER BY ct.id LIMIT 1
+            ) AS tags ON true""",
+            """LEFT JOIN LATERAL (
+                SELECT count(ua.completed_at) FROM e_user_assessments AS ua
+                WHERE ua.user_id=e_candidacies.user_id AND ua.completed_at IS NOT NULL
+            ) AS completed ON true""",
+            """LEFT JOIN LATERAL (
+                SELECT start_datetime FROM e_calendar_events WHERE candidacy_id=e_candidacies.id
+                ORDER BY id LIMIT 1
+            ) AS calendar ON true""",
+        ]
+        for event_type in ("email", "sms"):
+            # first event by id, together with the count
+            joins.append(f"""LEFT JOIN LATERAL (
+                SELECT count(*), (array_agg(created_at ORDER BY id))[1] AS created_at FROM e_events
+                WHERE candidacy_id=e_candidacies.id AND type='{event_type}'
+            ) AS {event_type} ON true""")
+        metric_columns = {
+            "tags": "tags.name",
+            "assessments_completed": "completed.count",
+            "email_messages_count": "email.count",
+            "sms_messages_count": "sms.count",
+            "last_email_created_at": "email.created_at",
+            "last_sms_created_at": "sms.created_at",
+            "calendar_events": "calendar.start_datetime",
+        }
+        return metric_columns, joins
+
+    def process_range(self, job_idx, jname, cur_path):
+        # range mode: one pass over [start_date, end_date) for the job, partitioned by candidacy created_at
+        # month into the same per-month reports process() writes for each month window
+        job_ids = [job_idx]
+
+        metadata = ORG_METADATA_CACHE.get(self.org_key, self.connect_psql)
+        custom_fields, assessments, assessment_ids = self.get_job_columns(metadata, job_idx)
+
+        if self.stream:
+            chunks = self.iter_candidacies(metadata, job_ids)
+        else:
+            chunks = iter([self.get_candidacies(metadata, job_ids)])
+        try:
+            first_chunk = next(chunks, None)
+            if not first_chunk:
+                return {}
+
+            non_pipeline_rows = self.connect_psql(self.non_pipeline_assessments_sql(by_month=True),
+                                                  self.non_pipeline_assessments_params(job_ids, assessment_ids))
+            layouts, pipeline_only_layout, all_assessments, all_scoring_dimensions = self.build_range_layouts(
+                metadata, assessments, custom_fields, non_pipeline_rows
+            )
 
+            with self.row_executor() as exe:
+                with MonthlyReports(self.month_report_path(cur_path, job_idx, jname), exe,
+                                    ROW_WINDOW if self.stream else None, self.sink) as reports:
+                    for candidacies in itertools.chain([first_chunk], chunks):
+                        lookups = self.load_row_lookups(candidacies, pipeline_only_layout.plan, all_assessments,
+                                                        all_scoring_dimensions, custom_fields)
+                        for key, month_candidacies in itertools.groupby(candidacies,
+                                                                        key=pipeline_only_layout.plan.month):
+                            layout = layouts.get(key, pipeline_only_layout)
+                            report = reports.report_for(key, layout)
+                            for candidacy in month_candidacies:
+                                report.submit(self.create_candidacy_record, candidacy, jname, layout, *lookups)
+            return reports.rows
+        finally:
+            if self.stream:
+                chunks.close()
+
+    def build_range_layouts(self,
+                            metadata,
+                            assessments,
+                            custom_fields,
+                            non_pipeline_rows,
+                            scoring_dimension_ids_by_assessment=None):
+        # the non-pipeline columns of each month only cover that month's candidacies
+        non_pipeline_assessments_by_month = {}
+        for month_start, *assessment in non_pipeline_rows:
+            key = (month_start.year, month_start.month)
+            non_pipeline_assessments_by_month.setdefault(key, []).append(tuple(assessment))
+
+        layouts = {
+            key: self.build_layout(metadata, assessments, non_pipeline_assessments, custom_fields,
+                                   scoring_dimension_ids_by_assessment)
+            for key, non_pipeline_assessments in non_pipeline_assessments_by_month.items()
+        }
+        pipeline_only_layout = self.build_layout(metadata, assessments, [], custom_fields,
+                                                 scoring_dimension_ids_by_assessment)
+
+        # lookups are loaded once per chunk for the columns of every month in the range
+        all_assessments = list({
+            assessment[0]: assessment
+            for layout in [pipeline_only_layout, *layouts.values()]
+            for assessment in layout.all_assessments if assessment
+        }.values())
+        all_scoring_dimensions = list({
+            sd[0]: sd
+            for layout in [pipeline_only_layout, *layouts.values()]
+            for sd in layout.all_scoring_dimensions if sd
+        }.values())
+        return layouts, pipeline_only_layout, all_assessments, all_scoring_dimensions
+
+    def month_report_path(self, cur_path, job_idx, jname):
+        def path_for(key):
+            folder = datetime(key[0], key[1], 1)
+            return self.report_path(cur_path, job_idx, jname,
+                                    datetime.strftime(folder, '%Y'), datetime.strftime(folder, '%b'))
+        return path_for
+
+    def load_row_lookups(self, candidacies, plan, all_assessments, all_scoring_dimensions, custom_fields):
+        # bulk lookups the row builder reads for one batch of candidacies
+        candidate_ids = tuple({candidacy[plan.id_index] for candidacy in candidacies})
+        metrics = self.get_candidacy_metrics(candidate_ids)
+        user_assessments = self.get_user_assessment_matrix(
+            candidate_ids,
+            [assessment[0] for assessment in all_assessments if assessment],
+        )
+        scoring_dimension_ratings = self.get_scoring_dimension_ratings(
+            candidate_ids,
+            [sd[0] for sd in all_scoring_dimensions if sd],
+        )
+        custom_field_answers = self.get_custom_field_answers(
+            {candidacy[plan.user_id_index] for candidacy in candidacies},
+            [custom_field[0] for custom_field in custom_fields if custom_field],
+        )
+        return metrics, user_assessments, scoring_dimension_ratings, custom_field_answers
 
     def create_candidacy_record(self,
                                 candidacy,
                                 jname,
-                                assessments,
-                                scoring_dimensions,
-                                non_pipeline_assessments,
-                                non_pipeline_scoring_dimensions,
-                                custom_fields
+                                layout,
+                                metrics,
+                                user_assessments,
+                                scoring_dimension_ratings,
+                                custom_field_answers
                                 ):
-        csv_values = []
-        candidacy_dict = {}
-        for field in CANDIDACY_FIELDS:
-            field_name = field.replace(".", "_")
-            field_index = CANDIDACY_FIELDS.index(field)
-            field_value = candidacy[field_index]
-            candidacy_dict.update({field_name: field_value})
-
-        csv_values.extend(
-            [
-                candidacy_dict["e_users_id"],
-                candidacy_dict["e_users_last_name"],
-                candidacy_dict["e_users_first_name"],
-                candidacy_dict["e_users_email"],
-                candidacy_dict["e_users_country_code"],
-                candidacy_dict["e_users_phone"],
-                candidacy_dict["e_candidacies_id"],
-                candidacy_dict["e_candidacies_created_at"],
-                candidacy_dict["e_pipeline_stages_name"],
-                candidacy_dict["e_candidacies_status"],
-                candidacy_dict["e_candidacies_failed"],
-            ]
-        )
-
-        # COMMENTING OUT BC WE DO THIS ON SAME JOB AGG
-        # select_jobs_sql = """
-        #     SELECT name FROM e_jobs WHERE id={};
-        # """.format(
-        #     candidacy_dict["e_candidacies_job_id"]
-        # )
-        # job_name = self.connect_psql(select_jobs_sql)
-        # # [('TICA | Customer Service Representative El Salvador',)]
-        # csv_values.append(job_name[0][0])
-        csv_values.append(jname)
-
-        select_tags_name_sql = """
-            SELECT t.name FROM e_tags AS t
-            INNER JOIN e_candidacy_tags AS ct ON ct.tag_id=t.id WHERE ct.candidacy_id={}
-        """.format(
-            candidacy_dict["e_candidacies_id"]
-        )
-        tags_name = self.connect_psql(select_tags_name_sql)
-        tags_name_str = "".join(tags_name[0]) if len(tags_name) > 0 else ""
-        csv_values.append(tags_name_str)
-
-        csv_values.extend(
-            [
-                candidacy_dict["e_candidacies_percentile"],
-                candidacy_dict["e_candidacies_weighted_percentage_score"],
-                candidacy_dict["e_candidacies_remaining_assessment_count"],
-            ]
-        )
-
-        select_user_assessments_completed_count_query = """
-                            SELECT count(ua.completed_at) 
-                            FROM e_candidacies AS c 
-                            INNER JOIN e_user_assessments AS ua ON c.user_id=ua.user_id 
-                            WHERE c.id={} AND ua.completed_at IS NOT NULL;
-                        """.format(
-            candidacy_dict["e_candidacies_id"]
-        )
-        user_assessments_completed_count = self.connect_psql(select_user_assessments_completed_count_query)
-        csv_values.append(user_assessments_completed_count[0][0])
-
-        csv_values.append(round((datetime.now() - candidacy_dict["e_candidacies_created_at"]).total_seconds()))
+        return layout.plan.build_row(candidacy, jname, metrics, user_assessments, scoring_dimension_ratings,
+                                     custom_field_answers)
+
+
+class AsyncOrgContext:
+    # asyncpg counterpart of OrgContext: one pool per config.ini section, with queries in flight bounded by
+    # an AsyncQueryLimit instead of one thread per checked out connection
+    def __init__(self, org, config_path='./config.ini', pool_max=None, profile=None):
+        if asyncpg is None:
+            raise RuntimeError("--engine async requires the asyncpg package")
+        read_org_config(self, org, config_path, pool_max)
+        self.profile = profile
+        self.pool = None
+        self.jobs = []
+        self.staging_table = None
+
+    async def open(self):
+        # queries in flight, as OrgContext.query_limit
+        self.query_limit = AsyncQueryLimit(self.POOL_MIN, self.QUERY_LIMIT_MIN, self.QUERY_LIMIT_MAX,
+                                           self.LATENCY_TOLERANCE)
+        self.metadata_lock = asyncio.Lock()
+        self.pool = await asyncpg.create_pool(database=self.DBNAME,
+                                              user=self.USER,
+                                              password=self.PASSWORD or None,
+                                              host=self.HOST,
+                                              port=int(self.PORT),
+                                              min_size=self.POOL_MIN,
+                                              max_size=self.POOL_MAX)
+        self.jobs = await self.get_jobs()
+        return self
+
+    async def fetch(self, sql, *params, described=False):
+        # rows as tuples; described: (column names, rows), the names read off the first record (None without rows)
+        waited_at = time.perf_counter()
+        async with self.query_limit.slot():
+            async with self.pool.acquire() as conn:
+                statement = to_dollar_params(sql)
+                started_at = time.perf_counter()
+                records = await conn.fetch(statement, *params)
+                rows = [tuple(row) for row in records]
+                if self.profile is not None:
+                    self.profile.record(statement, time.perf_counter() - started_at, len(rows), params,
+                                        started_at - waited_at)
+                if described:
+                    return (list(records[0].keys()) if records else None), rows
+                return rows
+
+    async def get_jobs(self):
+        return await self.fetch(SELECT_JOBS_SQL)
+
+    async def get_work_plan(self, start_date, end_date):
+        return build_work_plan(await self.fetch(SELECT_ACTIVITY_SQL, start_date, end_date), self.jobs)
+
+    async def get_metadata(self):
+        # the shared ORG_METADATA_CACHE entry, loaded with its queries in flight together on a miss
+        async with self.metadata_lock:
+            metadata = ORG_METADATA_CACHE.peek(self.org_key)
+            if metadata is None:
+                names = list(ORG_METADATA_QUERIES)
+                results = await asyncio.gather(*[self.fetch(ORG_METADATA_QUERIES[name]) for name in names])
+                metadata = ORG_METADATA_CACHE.put(self.org_key, OrgMetadata(dict(zip(names, results))))
+            return metadata
+
+    async def stage_candidacy_metrics(self, start_date, end_date):
+        for stale in stale_staging_tables(await self.fetch(SELECT_STAGING_TABLES_SQL), time.time()):
+            print(f"Dropping stale staging table {stale}")
+            await self.execute(f"DROP TABLE IF EXISTS {stale};")
+        table = staging_table_name()
+        await self.execute(CREATE_STAGED_METRICS_SQL.format(table=table, start_date=start_date, end_date=end_date))
+        self.staging_table = table
+
+    async def drop_staging(self):
+        if self.staging_table is not None:
+            await self.execute(f"DROP TABLE IF EXISTS {self.staging_table};")
+            self.staging_table = None
+
+    async def execute(self, sql):
+        waited_at = time.perf_counter()
+        async with self.query_limit.slot():
+            async with self.pool.acquire() as conn:
+                started_at = time.perf_counter()
+                await conn.execute(sql)
+                if self.profile is not None:
+                    self.profile.record(sql, time.perf_counter() - started_at, 0, (), started_at - waited_at)
+
+    async def explain(self, statement, params=()):
+        async with self.pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                return [row[0] for row in await conn.fetch(statement, *params)]
+            finally:
+                await transaction.rollback()
+
+    async def close(self):
+        if self.pool is not None:
+            try:
+                await self.drop_staging()
+            finally:
+                await self.pool.close()
+                self.pool = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncJobCandidates(JobCandidates):
+    # same reports as JobCandidates, with each job's independent queries issued as concurrent coroutines
+    # over an AsyncOrgContext; rows are built inline on the event loop
+    def __init__(self, start_date, end_date, org, context, stream=False, sink=CsvSink):
+        self.owns_context = False
+        self.context = context
+        self.DBNAME = context.DBNAME
+        self.org_key = context.org_key
+        self.jobs = context.jobs
+        self.start_date = start_date
+        self.end_date = end_date
+        self.stream = stream
+        self.executor = None
+        self.sink = sink
+
+    async def fetch(self, sql, *params):
+        return await self.context.fetch(sql, *params)
+
+    async def get_candidacies(self, metadata, job_ids):
+        select_candidacies_sql = self.candidacies_select_sql(metadata.candidacy_select_list)
+        names, rows = await self.context.fetch(select_candidacies_sql, *self.window_params(job_ids), described=True)
+        if rows:
+            metadata.read_candidacy_fields(names)
+        return rows
 
-        select_events_email_query = """
-                                SELECT count(*) FROM e_events 
-                                WHERE candidacy_id={} AND type='email';
-                            """.format(
-            candidacy_dict["e_candidacies_id"]
+    async def iter_candidacies(self, metadata, job_ids, chunk_size=CURSOR_ITERSIZE):
+        # server-side cursor inside a transaction; the connection stays checked out until the generator
+        # is exhausted or closed, and each round trip takes a query slot of its own
+        select_candidacies_sql = to_dollar_params(self.candidacies_select_sql(metadata.candidacy_select_list))
+        waited_at = time.perf_counter()
+        async with self.context.pool.acquire() as conn:
+            pool_wait = time.perf_counter() - waited_at
+            async with conn.transaction():
+                async with self.context.query_limit.slot():
+                    cur = await conn.cursor(select_candidacies_sql, *self.window_params(job_ids))
+                # fields: [statement, seconds, rows]
+                profiled = [select_candidacies_sql, time.perf_counter() - waited_at - pool_wait, 0]
+                while True:
+                    async with self.context.query_limit.slot():
+                        fetched_at = time.perf_counter()
+                        rows = await cur.fetch(chunk_size)
+                        profiled[1] += time.perf_counter() - fetched_at
+                    profiled[2] += len(rows)
+                    if not rows:
+                        break
+                    metadata.read_candidacy_fields(list(rows[0].keys()))
+                    yield [tuple(row) for row in rows]
+            if self.context.profile is not None:
+                self.context.profile.record(*profiled, (), pool_wait)
+
+    async def get_user_assessment_matrix(self, candidate_ids, assessment_ids):
+        assessment_index = {assessment_id: idx for idx, assessment_id in enumerate(dict.fromkeys(assessment_ids))}
+        if not candidate_ids or not assessment_index:
+            return assessment_index, {}
+        rows = await self.fetch(SELECT_USER_ASSESSMENTS_SQL, list(candidate_ids), list(assessment_index))
+        return assessment_index, build_user_assessment_matrix(assessment_index, rows)
+
+    async def resolve_scoring_dimension_ids(self, metadata, assessment_ids):
+        cache = metadata.scoring_dimension_ids
+        missing = [assessment_id for assessment_id in set(assessment_ids) if assessment_id not in cache]
+        if missing:
+            store_scoring_rule_ids(cache, missing, await self.fetch(SELECT_SCORING_RULES_SQL, missing))
+        return {assessment_id: cache[assessment_id] for assessment_id in assessment_ids}
+
+    async def get_scoring_dimension_ratings(self, candidate_ids, scoring_dimension_ids):
+        if not candidate_ids or not scoring_dimension_ids:
+            return {}
+        rows = await self.fetch(SELECT_SCORING_DIMENSION_RATINGS_SQL,
+                                list(candidate_ids), list(set(scoring_dimension_ids)))
+        return {(candidacy_id, scoring_dimension_id): percentage_score
+                for candidacy_id, scoring_dimension_id, percentage_score in rows}
+
+    async def get_candidacy_metrics(self, candidate_ids):
+        candidate_ids = list(candidate_ids)
+        if not candidate_ids:
+            return build_candidacy_metrics(candidate_ids, [], [], [], [])
+        if self.context.staging_table is not None:
+            select_staged_sql = SELECT_STAGED_METRICS_SQL.format(table=self.context.staging_table)
+            return build_staged_candidacy_metrics(candidate_ids, await self.fetch(select_staged_sql, candidate_ids))
+        results = await asyncio.gather(*[self.fetch(sql, candidate_ids) for sql in CANDIDACY_METRICS_QUERIES])
+        return build_candidacy_metrics(candidate_ids, *results)
+
+    async def load_row_lookups(self, candidacies, plan, all_assessments, all_scoring_dimensions, custom_fields):
+        candidate_ids = tuple({candidacy[plan.id_index] for candidacy in candidacies})
+        return await asyncio.gather(
+            self.get_candidacy_metrics(candidate_ids),
+            self.get_user_assessment_matrix(
+                candidate_ids,
+                [assessment[0] for assessment in all_assessments if assessment],
+            ),
+            self.get_scoring_dimension_ratings(
+                candidate_ids,
+                [sd[0] for sd in all_scoring_dimensions if sd],
+            ),
+            self.get_custom_field_answers(
+                {candidacy[plan.user_id_index] for candidacy in candidacies},
+                [custom_field[0] for custom_field in custom_fields if custom_field],
+            ),
         )
-        candidacies_events_email_count = self.connect_psql(select_events_email_query)
 
-        select_events_sms_query = """
-                                SELECT count(*) FROM e_events 
-                                WHERE candidacy_id={} AND type='sms';
-                            """.format(
-            candidacy_dict["e_candidacies_id"]
-        )
-        candidacies_events_sms_count = self.connect_psql(select_events_sms_query)
-
-        select_events_email_last_query = """
-                                SELECT created_at FROM e_events 
-                                WHERE candidacy_id={} AND type='email' 
-                                ORDER BY id LIMIT 1;
-                            """.format(
-            candidacy_dict["e_candidacies_id"]
-        )
-        candidacies_events_email_last_created_at = self.connect_psql(select_events_email_last_query)
-
-        select_events_sms_last_query = """
-                                SELECT created_at FROM e_events 
-                                WHERE candidacy_id={} AND type='sms' 
-                                ORDER BY id LIMIT 1;
-                            """.format(
-            candidacy_dict["e_candidacies_id"]
+    async def get_custom_field_answers(self, user_ids, custom_field_ids):
+        metadata = await self.context.get_metadata()
+        question_ids = metadata.get_question_ids(custom_field_ids)
+        if not user_ids or not question_ids:
+            return {}
+        rows = await self.fetch(SELECT_CUSTOM_FIELD_ANSWERS_SQL, list(user_ids), question_ids)
+        return build_custom_field_answers(metadata.custom_field_ids_by_question, rows)
+
+    async def open_candidacies(self, metadata, job_ids):
+        # (first chunk, async iterator over the remaining chunks)
+        if not self.stream:
+            return await self.get_candidacies(metadata, job_ids), None
+        chunks = self.iter_candidacies(metadata, job_ids)
+        try:
+            return await chunks.__anext__(), chunks
+        except StopAsyncIteration:
+            return [], None
+
+    async def open_candidacies_with(self, metadata, job_ids, query):
+        # open_candidacies and another query in flight together: (first chunk, chunks, query result). If either
+        # fails, an opened stream is closed (returning its connection) before the error is raised
+        opened, result = await asyncio.gather(self.open_candidacies(metadata, job_ids), query,
+                                              return_exceptions=True)
+        if isinstance(opened, BaseException):
+            raise opened
+        first_chunk, chunks = opened
+        if isinstance(result, BaseException):
+            if chunks is not None:
+                await chunks.aclose()
+            raise result
+        return first_chunk, chunks, result
+
+    async def process(self, job_idx, jname, cur_path, year, month):
+        job_ids = [job_idx]
+        metadata = await self.context.get_metadata()
+        custom_fields, assessments, assessment_ids = self.get_job_columns(metadata, job_idx)
+
+        first_chunk, chunks, non_pipeline_assessments = await self.open_candidacies_with(
+            metadata, job_ids,
+            self.fetch(self.non_pipeline_assessments_sql(),
+                       *self.non_pipeline_assessments_params(job_ids, assessment_ids)),
         )
-        candidacies_events_sms_last_created_at = self.connect_psql(select_events_sms_last_query)
+        try:
+            if not first_chunk:
+                return None
 
-        select_calendar_events_query = """
-                            SELECT start_datetime FROM e_calendar_events WHERE candidacy_id={};
-                        """.format(
-            candidacy_dict["e_candidacies_id"]
-        )
-        select_calendar_events_start_datetime = self.connect_psql(select_calendar_events_query)
-
-        csv_values.extend(
-            [
-                candidacies_events_email_count[0][0] if len(
-                    candidacies_events_email_count) > 0 else "",
-                candidacies_events_sms_count[0][0] if len(
-                    candidacies_events_sms_count) > 0 else "",
-                candidacies_events_email_last_created_at[0][0] if len(
-                    candidacies_events_email_last_created_at) > 0 else "",
-                candidacies_events_sms_last_created_at[0][0] if len(
-                    candidacies_events_sms_last_created_at) > 0 else "",
-                select_calendar_events_start_datetime[0][0] if len(
-                    select_calendar_events_start_datetime) > 0 else "",
-            ]
+            scoring_dimension_ids_by_assessment = await self.resolve_scoring_dimension_ids(
+                metadata,
+                [assessment[0] for assessment in assessments + non_pipeline_assessments if assessment]
+            )
+            layout = self.build_layout(metadata, assessments, non_pipeline_assessments, custom_fields,
+                                       scoring_dimension_ids_by_assessment)
+
+            path = self.report_path(cur_path, job_idx, jname, year, month)
+            with ReportFile(path, layout, None, ROW_WINDOW if self.stream else None, self.sink) as report:
+                candidacies = first_chunk
+                while candidacies is not None:
+                    lookups = await self.load_row_lookups(candidacies, layout.plan, layout.all_assessments,
+                                                          layout.all_scoring_dimensions, layout.custom_fields)
+                    for candidacy in candidacies:
+                        report.write(self.create_candidacy_record(candidacy, jname, layout, *lookups))
+                    candidacies = await anext_chunk(chunks)
+            return report.rows
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+
+    async def process_range(self, job_idx, jname, cur_path):
+        job_ids = [job_idx]
+        metadata = await self.context.get_metadata()
+        custom_fields, assessments, assessment_ids = self.get_job_columns(metadata, job_idx)
+
+        first_chunk, chunks, non_pipeline_rows = await self.open_candidacies_with(
+            metadata, job_ids,
+            self.fetch(self.non_pipeline_assessments_sql(by_month=True),
+                       *self.non_pipeline_assessments_params(job_ids, assessment_ids)),
         )
+        try:
+            if not first_chunk:
+                return {}
+
+            scoring_dimension_ids_by_assessment = await self.resolve_scoring_dimension_ids(
+                metadata,
+                [assessment[0] for assessment in assessments if assessment]
+                + [row[1] for row in non_pipeline_rows]
+            )
+            layouts, pipeline_only_layout, all_assessments, all_scoring_dimensions = self.build_range_layouts(
+                metadata, assessments, custom_fields, non_pipeline_rows, scoring_dimension_ids_by_assessment
+            )
 
-        for assessment in assessments:
-            if not assessment:
+            with MonthlyReports(self.month_report_path(cur_path, job_idx, jname), None,
+                                ROW_WINDOW if self.stream else None, self.sink) as reports:
+                candidacies = first_chunk
+                while candidacies is not None:
+                    lookups = await self.load_row_lookups(candidacies, pipeline_only_layout.plan, all_assessments,
+                                                          all_scoring_dimensions, custom_fields)
+                    for key, month_candidacies in itertools.groupby(candidacies,
+                                                                    key=pipeline_only_layout.plan.month):
+                        layout = layouts.get(key, pipeline_only_layout)
+                        report = reports.report_for(key, layout)
+                        for candidacy in month_candidacies:
+                            report.write(self.create_candidacy_record(candidacy, jname, layout, *lookups))
+                    candidacies = await anext_chunk(chunks)
+            return reports.rows
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+
+
+async def anext_chunk(chunks):
+    # next chunk of an AsyncJobCandidates.iter_candidacies generator, None once it is exhausted (or without one)
+    if chunks is None:
+        return None
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+ORG_NAMES = [
+            #'telus', # done
+             #'tieu', # done
+             'tiir',
+             'tiph',
+             'tius',
+             'telusinternational',]
+
+
+def schedule_jobs(org, plan, cur_path, range_mode, job_candidates, manifest=None, force=False):
+    # ScheduledJobs for a work plan; job_candidates(start_date, end_date) makes the (Async)JobCandidates
+    # of a date window. Reports the manifest has as current are skipped (unless force) and every finished
+    # report is recorded in it
+    jobs = []
+    skipped = 0
+    if range_mode:
+        rep = job_candidates(datetime.strftime(REPORT_START, '%Y-%m-%d'), datetime.strftime(REPORT_END, '%Y-%m-%d'))
+        job_items = {}
+        for item in plan:
+            job_items.setdefault((item.job_id, item.job_name), []).append(item)
+        print(f"Jobs with candidacies: {len(job_items)} ")
+        for (job_id, job_name), items in job_items.items():
+            paths = {
+                (item.month_start.year, item.month_start.month): rep.report_path(
+                    cur_path, job_id, job_name,
+                    datetime.strftime(item.month_start, '%Y'), datetime.strftime(item.month_start, '%b'))
+                for item in items
+            }
+            # one pass covers every month of the job, so the job reruns when any of its months is stale
+            if manifest is not None and not force and all(
+                manifest.is_current(org, item, paths[(item.month_start.year, item.month_start.month)])
+                for item in items
+            ):
+                skipped += len(items)
                 continue
-            # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
-            select_candidacy_user_assessments_query = """
-                                    SELECT ua.percentage_score, c.score, ua.started_at, ua.completed_at 
-                                    FROM e_candidacies AS c 
-                                    INNER JOIN e_user_assessments AS ua ON c.user_id=ua.user_id 
-                                    WHERE c.id={} AND ua.assessment_id={};
-
-                                """.format(
-                candidacy_dict["e_candidacies_id"], assessment[0]
-            )
-            candidacy_user_assessments = self.connect_psql(select_candidacy_user_assessments_query)
-
-            if len(candidacy_user_assessments) > 0:
-                csv_values.extend(
-                    [
-                        candidacy_user_assessments[0][0],
-                        candidacy_dict["e_candidacies_percentile"],
-                        candidacy_user_assessments[0][1],
-                        candidacy_user_assessments[0][2],
-                        candidacy_user_assessments[0][3],
-                    ]
-                )
-            else:
-                csv_values.extend(["", "", "", "", ""])
-
-        for sd in scoring_dimensions:
-            if sd:
-                select_sdr_query = """
-                               SELECT percentage_score 
-                               FROM e_scoring_dimension_ratings 
-                               WHERE candidacy_id={} AND scoring_dimension_id={}
-                           """.format(
-                    candidacy_dict["e_candidacies_id"], sd[0]
-                )
-                sdr = self.connect_psql(select_sdr_query)
-                csv_values.extend([sdr[0][0], candidacy_dict["e_candidacies_percentile"]])
-            else:
-                csv_values.extend(['', candidacy_dict["e_candidacies_percentile"]])
 
-        for assessment in non_pipeline_assessments:
-            # fields: ['id', 'name', 'type', 'slug', 'created_at', 'updated_at']
-            select_candidacy_user_assessments_query = """
-                                    SELECT ua.percentage_score, c.score, ua.started_at, ua.completed_at 
-                                    FROM e_candidacies AS c 
-                                    INNER JOIN e_user_assessments AS ua ON c.user_id=ua.user_id 
-                                    WHERE c.id={} AND ua.assessment_id={};
-
-                                """.format(
-                candidacy_dict["e_candidacies_id"], assessment[0]
-            )
-            candidacy_user_assessments = self.connect_psql(select_candidacy_user_assessments_query)
-
-            if len(candidacy_user_assessments) > 0:
-                csv_values.extend(
-                    [
-                        candidacy_user_assessments[0][0],
-                        candidacy_dict["e_candidacies_percentile"],
-                        candidacy_user_assessments[0][1],
-                        candidacy_user_assessments[0][2],
-                        candidacy_user_assessments[0][3],
-                    ]
-                )
-            else:
-                csv_values.extend(["", "", "", "", ""])
-
-        for sd in non_pipeline_scoring_dimensions:
-            if sd:
-                select_sdr_query = f"""
-                            SELECT percentage_score 
-                            FROM e_scoring_dimension_ratings 
-                            WHERE candidacy_id={candidacy_dict["e_candidacies_id"]} 
-                            AND scoring_dimension_id={sd[0]};
-                        """
-                sdr = self.connect_psql(select_sdr_query)
-                csv_values.extend([sdr[0][0], candidacy_dict["e_candidacies_percentile"]])
-            else:
-                csv_values.extend(['', candidacy_dict["e_candidacies_percentile"]])
-
-        for custom_field in custom_fields:
-            select_custom_field_query = """
-                SELECT value 
-                FROM e_answers 
-                WHERE question_id IN 
-                (SELECT id FROM e_questions WHERE custom_field_id={}) AND value<>'';
-            """.format(
-                custom_field[0]
-            )
-            custom_field_value = self.connect_psql(select_custom_field_query)
-            val = custom_field_value[0][0] if len(custom_field_value) > 0 else ""
-            csv_values.append(val)
-            return csv_values
+            def record(result, items=items, paths=paths):
+                for item in items:
+                    key = (item.month_start.year, item.month_start.month)
+                    if key in result:
+                        manifest.record(org, item, paths[key], result[key])
+
+            fn = rep.process_range if manifest is None else record_after(rep.process_range, record)
+            jobs.append(ScheduledJob(sum(item.candidacies for item in items), f"{org} job {job_id}",
+                                     fn, (job_id, job_name, cur_path)))
+    else:
+        print(f"Planned reports: {len(plan)} ")
+        windows = {}
+        for item in plan:
+            year = datetime.strftime(item.month_start, '%Y')
+            month = datetime.strftime(item.month_start, '%b')
+            rep = windows.get(item.month_start)
+            if rep is None:
+                rep = windows[item.month_start] = job_candidates(
+                    datetime.strftime(item.month_start, '%Y-%m-%d'),
+                    datetime.strftime(next_month(item.month_start), '%Y-%m-%d'))
+            path = rep.report_path(cur_path, item.job_id, item.job_name, year, month)
+            if manifest is not None and not force and manifest.is_current(org, item, path):
+                skipped += 1
+                continue
 
-if __name__ == "__main__":
-    ORG_NAMES = [
-                #'telus', # done
-                 #'tieu', # done
-                 'tiir',
-                 'tiph',
-                 'tius',
-                 'telusinternational',]
-
-    for org in ORG_NAMES:
+            def record(result, item=item, path=path):
+                if result is not None:
+                    manifest.record(org, item, path, result)
+
+            fn = rep.process if manifest is None else record_after(rep.process, record)
+            jobs.append(ScheduledJob(item.candidacies, f"{org} {month}-{year} job {item.job_id}",
+                                     fn, (item.job_id, item.job_name, cur_path, year, month)))
+    if skipped:
+        print(f"Up to date: {skipped} reports")
+    return jobs, skipped
+
+
+def record_after(fn, record):
+    # fn (a plain or coroutine function) followed by record(result) once it returns
+    if asyncio.iscoroutinefunction(fn):
+        async def recorded(*args):
+            result = await fn(*args)
+            record(result)
+            return result
+    else:
+        def recorded(*args):
+            result = fn(*args)
+            record(result)
+            return result
+    return recorded
+
+
+def add_job_results(summary, results, range_mode):
+    failed = 0
+    for job, result, error in results:
+        if error is not None:
+            failed += 1
+        elif range_mode:
+            summary["reports"] += len(result)
+            summary["rows"] += sum(result.values())
+        elif result is not None:
+            summary["reports"] += 1
+            summary["rows"] += result
+    if failed:
+        summary["error"] = f"{failed} of {len(results)} jobs failed"
+
+
+def run_org(org, cur_path, range_mode=False, stream=False, pool_max=None, job_workers=None, engine="threads",
+            copy=False, force=False, staging=False, profile=False, explain=0, output_format="csv", query_cache=None,
+            query_cache_mb=QUERY_CACHE_MB):
+    # generates every report of one org; runnable in its own worker process, and a failure is
+    # returned in the summary instead of raised so the other orgs keep going
+    if engine == "async":
+        return asyncio.run(run_org_async(org, cur_path, range_mode, stream, pool_max, job_workers, force, staging,
+                                         profile, explain, output_format))
+    summary = {"org": org, "reports": 0, "rows": 0, "skipped": 0, "error": None}
+    started_at = time.time()
+    try:
         print(f"STARTING {org}")
-        cur_path = os.path.abspath(os.path.dirname(__file__))
-        start_date = datetime(2019, 10, 1, 0, 0)
-        while start_date < datetime(2021, 1, 1, 0, 0):
-            year = datetime.strftime(start_date, '%Y')
-            month = datetime.strftime(start_date, '%b')
-            if start_date.month == 12:
-                end_date = start_date.replace(month=1, year= start_date.year + 1)
-            else:
-                end_date = start_date.replace(month=start_date.month+1)
-            print(f"Folder: {month}-{year}")
-            rep = JobCandidates(start_date=datetime.strftime(start_date, '%Y-%m-%d'),
-                                end_date=datetime.strftime(end_date, '%Y-%m-%d'),
-                                org=org)
-            print(f"Total Jobs: {len(rep.jobs)} ")
-            counter = 0
-            for job in rep.jobs:
-                rep.process(job[0], job[1], cur_path, year, month)
-
+        manifest = RunManifest(os.path.join(cur_path, MANIFEST_NAME))
+        query_profile = QueryProfile(org) if profile or explain else None
+        cache = QueryCache(query_cache, query_cache_mb * 2 ** 20) if query_cache else None
+        with OrgContext(org, pool_max=pool_max, profile=query_profile, query_cache=cache) as context, \
+                ThreadPoolExecutor(max_workers=cpu_count()) as exe:
+            print(f"Total Jobs: {len(context.jobs)} ")
+            plan = context.get_work_plan(REPORT_START, REPORT_END)
+            jobs, summary["skipped"] = schedule_jobs(org, plan, cur_path, range_mode,
+                                 lambda start_date, end_date: JobCandidates(start_date=start_date,
+                                                                            end_date=end_date,
+                                                                            org=org,
+                                                                            context=context,
+                                                                            stream=stream,
+                                                                            executor=exe,
+                                                                            copy=copy,
+                                                                            sink=REPORT_SINKS[output_format]),
+                                                       manifest, force)
+
+            if staging and jobs:
+                staged_at = time.time()
+                context.stage_candidacy_metrics(REPORT_START, REPORT_END)
+                print(f"Staged candidacy metrics in {time.time() - staged_at:.1f}s")
+
+            # jobs share the org pool: each holds up to CONNECTIONS_PER_JOB connections at a time
+            workers = min(job_workers or context.job_slots, context.job_slots)
+            print(f"Running {len(jobs)} jobs on {workers} workers")
+            with logging_query_limit(org, context.query_limit):
+                add_job_results(summary, JobScheduler(workers).run(jobs), range_mode)
+            if cache is not None:
+                print(f"{org}: {cache.stats_line()}")
+
+            if query_profile is not None:
+                for template, statement, params in query_profile.explain_targets(explain):
+                    try:
+                        query_profile.plans[template] = context.explain(statement, params)
+                    except Exception as error:
+                        query_profile.plans[template] = [f"EXPLAIN failed: {error}"]
+                print(f"Query profile: {query_profile.write(os.path.join(cur_path, 'reports', context.DBNAME))[1]}")
 
             print('=' * 40)
+            print("Closing DB")
+        print(f"DONE with {org}")
+    except Exception:
+        summary["error"] = traceback.format_exc()
+        print(f"FAILED {org}\n{summary['error']}")
+    summary["elapsed"] = time.time() - started_at
+    return summary
+
+
+async def run_org_async(org, cur_path, range_mode=False, stream=False, pool_max=None, job_workers=None,
+                        force=False, staging=False, profile=False, explain=0, output_format="csv"):
+    # run_org on the asyncio engine: the org's jobs run as coroutines, at most job_slots at a time
+    summary = {"org": org, "reports": 0, "rows": 0, "skipped": 0, "error": None}
+    started_at = time.time()
+    try:
+        print(f"STARTING {org}")
+        manifest = RunManifest(os.path.join(cur_path, MANIFEST_NAME))
+        query_profile = QueryProfile(org) if profile or explain else None
+        async with AsyncOrgContext(org, pool_max=pool_max, profile=query_profile) as context:
+            print(f"Total Jobs: {len(context.jobs)} ")
+            plan = await context.get_work_plan(REPORT_START, REPORT_END)
+            jobs, summary["skipped"] = schedule_jobs(org, plan, cur_path, range_mode,
+                                 lambda start_date, end_date: AsyncJobCandidates(start_date=start_date,
+                                                                                 end_date=end_date,
+                                                                                 org=org,
+                                                                                 context=context,
+                                                                                 stream=stream,
+                                                                                 sink=REPORT_SINKS[output_format]),
+                                                       manifest, force)
+
+            if staging and jobs:
+                staged_at = time.time()
+                await context.stage_candidacy_metrics(REPORT_START, REPORT_END)
+                print(f"Staged candidacy metrics in {time.time() - staged_at:.1f}s")
+
+            workers = min(job_workers or context.job_slots, context.job_slots)
+            print(f"Running {len(jobs)} jobs on {workers} coroutines")
+            job_slots = asyncio.Semaphore(workers)
+
+            async def run_job(job):
+                async with job_slots:
+                    try:
+                        return job, await job.fn(*job.args), None
+                    except Exception:
+                        print(f"FAILED {job.label}\n{traceback.format_exc()}")
+                        return job, None, traceback.format_exc()
+
+            jobs.sort(key=lambda job: -job.size)
+            with logging_query_limit(org, context.query_limit):
+                add_job_results(summary, await asyncio.gather(*[run_job(job) for job in jobs]), range_mode)
+
+            if query_profile is not None:
+                for template, statement, params in query_profile.explain_targets(explain):
+                    try:
+                        query_profile.plans[template] = await context.explain(statement, params)
+                    except Exception as error:
+                        query_profile.plans[template] = [f"EXPLAIN failed: {error}"]
+                print(f"Query profile: {query_profile.write(os.path.join(cur_path, 'reports', context.DBNAME))[1]}")
 
+            print('=' * 40)
+            print("Closing DB")
+        print(f"DONE with {org}")
+    except Exception:
+        summary["error"] = traceback.format_exc()
+        print(f"FAILED {org}\n{summary['error']}")
+    summary["elapsed"] = time.time() - started_at
+    return summary
+
+
+def run_orgs(orgs, cur_path, workers=1, max_connections=None, **options):
+    # one worker process per org (at most `workers` at a time); max_connections caps the sum of the
+    # connection pools of the orgs that can run concurrently
+    pool_max = None
+    if max_connections:
+        pool_max = max(1, max_connections // max(1, min(workers, len(orgs))))
+
+    if workers <= 1:
+        summaries = [run_org(org, cur_path, pool_max=pool_max, **options) for org in orgs]
+    else:
+        summaries = []
+        with ProcessPoolExecutor(max_workers=workers) as exe:
+            futures = [(org, exe.submit(run_org, org, cur_path, pool_max=pool_max, **options)) for org in orgs]
+            for org, future in futures:
+                try:
+                    summaries.append(future.result())
+                except Exception:
+                    # the worker process itself died (e.g. BrokenProcessPool)
+                    summaries.append({"org": org, "reports": 0, "rows": 0, "skipped": 0,
+                                      "error": traceback.format_exc(), "elapsed": 0.0})
+
+    print("SUMMARY")
+    for summary in summaries:
+        status = "FAILED" if summary["error"] else "OK"
+        print(f"{summary['org']:<24} {status:<7} reports={summary['reports']:<6} "
+              f"rows={summary['rows']:<9} up_to_date={summary['skipped']:<6} elapsed={summary['elapsed']:.1f}s")
+    return summaries
+
+
+def enqueue_orgs(queue_path, orgs, cur_path, output_format="csv", force=False):
+    # work-queue mode: adds the (org, month, job) tasks of each org's work plan to the queue, leaving out the
+    # reports the manifest has as up to date (unless force)
+    queue = WorkQueue(queue_path)
+    manifest = RunManifest(os.path.join(cur_path, MANIFEST_NAME))
+    summaries = []
+    for org in orgs:
+        summary = {"org": org, "queued": 0, "skipped": 0, "error": None}
+        try:
+            # planning needs one connection
+            with OrgContext(org, pool_max=CONNECTIONS_PER_JOB) as context:
+                plan = context.get_work_plan(REPORT_START, REPORT_END)
+                rep = JobCandidates(start_date=datetime.strftime(REPORT_START, '%Y-%m-%d'),
+                                    end_date=datetime.strftime(REPORT_END, '%Y-%m-%d'),
+                                    org=org,
+                                    context=context,
+                                    sink=REPORT_SINKS[output_format])
+            items = [
+                item for item in plan
+                if force or not manifest.is_current(org, item, rep.report_path(
+                    cur_path, item.job_id, item.job_name,
+                    datetime.strftime(item.month_start, '%Y'), datetime.strftime(item.month_start, '%b')))
+            ]
+            summary["skipped"] = len(plan) - len(items)
+            summary["queued"] = queue.add(org, items, force)
+        except Exception:
+            summary["error"] = traceback.format_exc()
+            print(f"FAILED {org}\n{summary['error']}")
+        summaries.append(summary)
+
+    print("SUMMARY")
+    for summary in summaries:
+        status = "FAILED" if summary["error"] else "OK"
+        print(f"{summary['org']:<24} {status:<7} queued={summary['queued']:<6} up_to_date={summary['skipped']:<6}")
+    print(f"Queue {queue_path}: " + ", ".join(f"{status}={count}" for status, count in sorted(queue.counts().items())))
+    return summaries
+
+
+def run_worker(queue_path, cur_path, stream=False, pool_max=None, job_workers=None, copy=False,
+               output_format="csv", lease_seconds=QUEUE_LEASE_SECONDS, query_cache=None, query_cache_mb=QUERY_CACHE_MB):
+    # work-queue mode: claims tasks on job_workers threads and runs JobCandidates.process for each, until no task
+    # is pending or leased anywhere; an org's pool is opened lazily on its first task and closed once the worker
+    # has none of its tasks in hand and none are pending, so a worker holds pools only for the orgs it is on
+    queue = WorkQueue(queue_path, lease_seconds)
+    cache = QueryCache(query_cache, query_cache_mb * 2 ** 20) if query_cache else None
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    manifest = RunManifest(os.path.join(cur_path, MANIFEST_NAME))
+    summary = {"org": owner, "reports": 0, "rows": 0, "skipped": 0, "error": None}
+    started_at = time.time()
+    lock = threading.Lock()
+    contexts = {}
+    windows = {}
+    # per org: a job_slots semaphore (jobs share the org pool, CONNECTIONS_PER_JOB each) and the tasks in hand
+    org_slots = {}
+    in_hand = Counter()
+    running = set()
+    failed = []
+    stopped = threading.Event()
+
+    def job_candidates(org, month_start):
+        while True:
+            with lock:
+                if org in contexts:
+                    in_hand[org] += 1
+                    rep = windows.get((org, month_start))
+                    if rep is None:
+                        rep = windows[(org, month_start)] = JobCandidates(
+                            start_date=datetime.strftime(month_start, '%Y-%m-%d'),
+                            end_date=datetime.strftime(next_month(month_start), '%Y-%m-%d'),
+                            org=org,
+                            context=contexts[org],
+                            stream=stream,
+                            executor=exe,
+                            copy=copy,
+                            sink=REPORT_SINKS[output_format])
+                    return rep, org_slots[org]
+            # opened outside the lock: it connects and loads the org's jobs, which must not hold up the
+            # threads on other orgs. Of two threads opening one org at once, the second closes its copy
+            context = OrgContext(org, pool_max=pool_max, query_cache=cache, lazy=True)
+            with lock:
+                if org not in contexts:
+                    contexts[org] = context
+                    org_slots[org] = threading.Semaphore(context.job_slots)
+                    context = None
+            if context is not None:
+                context.close()
+
+    def release(org):
+        # closes org's pool after its last task in hand unless more are pending; one claimed meanwhile by
+        # another thread either already counts as in hand or reopens the pool
+        with lock:
+            in_hand[org] -= 1
+            if in_hand[org]:
+                return
+        if queue.has_pending(org):
+            return
+        with lock:
+            if in_hand[org] or org not in contexts:
+                return
+            del in_hand[org], org_slots[org]
+            for key in [key for key in windows if key[0] == org]:
+                del windows[key]
+            context = contexts.pop(org)
+        context.close()
+
+    def heartbeat():
+        while not stopped.wait(lease_seconds / 3):
+            with lock:
+                task_ids = list(running)
+            try:
+                if task_ids:
+                    queue.heartbeat(owner, task_ids)
+            except Exception:
+                print(f"Heartbeat failed\n{traceback.format_exc()}")
+
+    def work():
+        while True:
+            claimed = queue.claim(owner)
+            if claimed is None:
+                if not queue.counts().get("leased"):
+                    return
+                time.sleep(QUEUE_POLL_SECONDS)
+                continue
+            task_id, org, item = claimed
+            year = datetime.strftime(item.month_start, '%Y')
+            month = datetime.strftime(item.month_start, '%b')
+            with lock:
+                running.add(task_id)
+            rep = None
+            try:
+                rep, job_slots = job_candidates(org, item.month_start)
+                # the report is only renamed into place, and recorded, while this worker still holds the lease:
+                # once it expired the task is another worker's, whose run counts instead
+                completed = []
+
+                def publish(rows, task_id=task_id):
+                    completed.append(queue.complete(task_id, owner, rows))
+                    return completed[0]
+
+                with job_slots:
+                    rows = rep.process(item.job_id, item.job_name, cur_path, year, month, publish)
+                owned = completed[0] if completed else queue.complete(task_id, owner, rows)
+                if owned and rows is not None:
+                    manifest.record(org, item, rep.report_path(cur_path, item.job_id, item.job_name, year, month),
+                                    rows)
+            except Exception:
+                print(f"FAILED {org} {month}-{year} job {item.job_id}\n{traceback.format_exc()}")
+                queue.fail(task_id, owner, traceback.format_exc())
+                with lock:
+                    failed.append(task_id)
+            else:
+                if not owned:
+                    print(f"LEASE LOST {org} {month}-{year} job {item.job_id}: left to its new owner")
+                elif rows is not None:
+                    with lock:
+                        summary["reports"] += 1
+                        summary["rows"] += rows
+            finally:
+                with lock:
+                    running.discard(task_id)
+                if rep is not None:
+                    release(org)
+
+    workers = job_workers or cpu_count()
+    if pool_max is not None:
+        # every job may be on the same org, whose pool is capped at pool_max
+        workers = min(workers, max(1, pool_max // CONNECTIONS_PER_JOB))
+    print(f"STARTING worker {owner} on {queue_path} with {workers} threads")
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        with ThreadPoolExecutor(max_workers=cpu_count()) as exe:
+            threads = [threading.Thread(target=work) for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    except Exception:
+        summary["error"] = traceback.format_exc()
+        print(f"FAILED worker {owner}\n{summary['error']}")
+    finally:
+        stopped.set()
+        heartbeat_thread.join()
+        for context in contexts.values():
+            context.close()
+    if cache is not None:
+        print(f"{owner}: {cache.stats_line()}")
+    if failed and summary["error"] is None:
+        summary["error"] = f"{len(failed)} task runs failed"
+    summary["elapsed"] = time.time() - started_at
+    return summary
+
+
+def run_workers(queue_path, cur_path, workers=1, max_connections=None, **options):
+    # work-queue mode on this machine: `workers` worker processes on the same queue (more can be started
+    # anywhere the queue file and the reports folder are shared); max_connections is split between them
+    pool_max = max(1, max_connections // workers) if max_connections else None
+    if workers <= 1:
+        summaries = [run_worker(queue_path, cur_path, pool_max=pool_max, **options)]
+    else:
+        summaries = []
+        with ProcessPoolExecutor(max_workers=workers) as exe:
+            futures = [exe.submit(run_worker, queue_path, cur_path, pool_max=pool_max, **options)
+                       for _ in range(workers)]
+            for future in futures:
+                try:
+                    summaries.append(future.result())
+                except Exception:
+                    summaries.append({"org": "worker", "reports": 0, "rows": 0, "skipped": 0,
+                                      "error": traceback.format_exc(), "elapsed": 0.0})
+
+    print("SUMMARY")
+    for summary in summaries:
+        status = "FAILED" if summary["error"] else "OK"
+        print(f"{summary['org']:<24} {status:<7} reports={summary['reports']:<6} "
+              f"rows={summary['rows']:<9} elapsed={summary['elapsed']:.1f}s")
+    print(f"Queue {queue_path}: " + ", ".join(
+        f"{status}={count}" for status, count in sorted(WorkQueue(queue_path).counts().items())))
+    return summaries
 
-            start_date = end_date
 
-        print("Closing DB")
-        rep.tcp.closeall()
-        print(f"DONE with {org}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate monthly candidacy reports for every job of each org.")
+    parser.add_argument("--stream", action="store_true",
+                        help="read candidacies through a server-side cursor and write rows incrementally")
+    parser.add_argument("--range", action="store_true",
+                        help="read each job once for the whole date range and split its rows into monthly reports")
+    parser.add_argument("--orgs", nargs="+", default=ORG_NAMES, help="config.ini sections to run")
+    parser.add_argument("--parallel", type=int, default=1, help="orgs to run at once, each in its own process")
+    parser.add_argument("--max-connections", type=int, default=None,
+                        help="cap on database connections summed over the orgs running at once")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="reports generated at once per org (default and ceiling: pool size / 2)")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads",
+                        help="run queries on a thread pool (psycopg2) or as coroutines (asyncpg)")
+    parser.add_argument("--force", action="store_true",
+                        help="regenerate every report, including those the manifest has as up to date")
+    parser.add_argument("--staging", action="store_true",
+                        help="precompute per-candidacy metrics into an unlogged table at the start of each org run")
+    parser.add_argument("--copy", action="store_true",
+                        help="assemble each report in one SQL statement and COPY it straight into the file")
+    parser.add_argument("--format", choices=list(REPORT_SINKS), default="csv",
+                        help="report file format: csv, compressed csv or typed columns (Parquet / Arrow IPC)")
+    parser.add_argument("--queue", metavar="PATH",
+                        help="work-queue mode: run as a worker on the SQLite task queue at PATH (see --enqueue)")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="with --queue: add the (org, month, job) tasks of --orgs to the queue and exit")
+    parser.add_argument("--lease", type=int, default=QUEUE_LEASE_SECONDS, metavar="SECONDS",
+                        help="with --queue: lease of a claimed task, renewed while it runs and retried once expired")
+    parser.add_argument("--query-cache", metavar="PATH",
+                        help="keep query results in the SQLite file at PATH and reuse them while their tables are "
+                             "unchanged (row count and latest updated_at, checked once per run)")
+    parser.add_argument("--query-cache-mb", type=int, default=QUERY_CACHE_MB, metavar="MB",
+                        help="with --query-cache: size of the cache, past which the least recently used results go")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every query by template and write a query profile next to each org's reports")
+    parser.add_argument("--explain", type=int, default=0, metavar="N",
+                        help="with the profile, EXPLAIN (ANALYZE, BUFFERS) the slowest run of the N costliest templates")
+    args = parser.parse_args()
+    if args.copy and (args.range or args.engine != "threads"):
+        parser.error("--copy works on monthly reports with --engine threads only")
+    if args.copy and not hasattr(REPORT_SINKS[args.format], "copy"):
+        parser.error("--copy writes csv output only (--format csv, csv.gz or csv.zst)")
+    if args.enqueue and not args.queue:
+        parser.error("--enqueue needs --queue")
+    if args.queue and (args.range or args.engine != "threads" or args.staging):
+        parser.error("--queue runs monthly reports with --engine threads, without --range or --staging")
+    if args.query_cache and args.engine != "threads":
+        parser.error("--query-cache works with --engine threads only")
+    # each process gets an even share of --max-connections, and a stream job holds CONNECTIONS_PER_JOB
+    processes = args.parallel if args.queue else min(args.parallel, len(args.orgs))
+    if args.max_connections is not None and args.max_connections < CONNECTIONS_PER_JOB * max(1, processes):
+        parser.error(f"--max-connections must be at least {CONNECTIONS_PER_JOB} per process "
+                     f"({CONNECTIONS_PER_JOB * max(1, processes)} here)")
+    if args.format in ("parquet", "arrow") and pyarrow is None:
+        parser.error(f"--format {args.format} requires the pyarrow package")
+    if args.format == "csv.zst" and zstandard is None:
+        parser.error("--format csv.zst requires the zstandard package")
+
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    if args.enqueue:
+        summaries = enqueue_orgs(args.queue, args.orgs, cur_path, output_format=args.format, force=args.force)
+    elif args.queue:
+        summaries = run_workers(args.queue, cur_path,
+                                workers=args.parallel,
+                                max_connections=args.max_connections,
+                                stream=args.stream,
+                                job_workers=args.jobs,
+                                copy=args.copy,
+                                output_format=args.format,
+                                lease_seconds=args.lease,
+                                query_cache=args.query_cache,
+                                query_cache_mb=args.query_cache_mb)
+    else:
+        summaries = run_orgs(args.orgs, cur_path,
+                             workers=args.parallel,
+                             max_connections=args.max_connections,
+                             range_mode=args.range,
+                             stream=args.stream,
+                             job_workers=args.jobs,
+                             engine=args.engine,
+                             copy=args.copy,
+                             force=args.force,
+                             staging=args.staging,
+                             profile=args.profile,
+                             explain=args.explain,
+                             output_format=args.format,
+                             query_cache=args.query_cache,
+                             query_cache_mb=args.query_cache_mb)
     print("DONE")
+    if any(summary["error"] for summary in summaries):
+        sys.exit(1)